@@ -0,0 +1,133 @@
+import tempfile
+import threading
+import numpy as np
+import ffmpeg
+
+
+def iter_pcm_chunks(media_path, sample_rate=16000, chunk_seconds=10):
+    """
+    Decode a media file with ffmpeg and yield its audio as int16 mono chunks of a fixed size.
+    The chunks are views of one preallocated buffer, so each is only valid until the next is read.
+    """
+    process = (
+        ffmpeg.input(media_path)
+        .output("pipe:1", format="s16le", acodec="pcm_s16le", ac=1, ar=sample_rate)
+        .global_args("-nostdin", "-loglevel", "error")
+        .run_async(pipe_stdout=True)
+    )
+    chunk_buffer = bytearray(int(chunk_seconds * sample_rate) * 2)
+    chunk_view = memoryview(chunk_buffer)
+    try:
+        while True:
+            # Fill the whole buffer; a pipe read can return less than was asked for
+            filled = 0
+            while filled < len(chunk_buffer):
+                read = process.stdout.readinto(chunk_view[filled:])
+                if not read:
+                    break
+                filled += read
+            filled -= filled % 2  # Whole samples only
+            if filled:
+                yield np.frombuffer(chunk_buffer, dtype=np.int16, count=filled // 2)
+            if filled < len(chunk_buffer):
+                break
+    finally:
+        process.stdout.close()
+        return_code = process.wait()
+    if return_code != 0:
+        raise ffmpeg.Error("ffmpeg", None, None)
+
+
+class StreamingDecoder:
+    """
+    Decode a media file in a background thread into a float32 buffer that is memory-mapped onto an
+    unlinked temporary file, so resident memory stays at one chunk however long the recording is.
+    Consumers can call wait_for(sample_count) to start on the audio before the decode has finished.
+    """
+
+    def __init__(
+        self,
+        media_path,
+        sample_rate=16000,
+        chunk_seconds=10,
+        expected_seconds=0,
+        temporary_dir=None,
+    ):
+        self.media_path = media_path
+        self.sample_rate = sample_rate
+        self.chunk_seconds = chunk_seconds
+        self.decoded_samples = 0
+        self.finished = False
+        self.error = None
+        self._condition = threading.Condition()
+        self._file = tempfile.TemporaryFile(dir=temporary_dir)
+        self._capacity = 0
+        self._resize(int((expected_seconds + chunk_seconds) * sample_rate))
+        self._thread = threading.Thread(
+            target=self._decode, name="streaming-decoder", daemon=True
+        )
+        self._thread.start()
+
+    def _resize(self, capacity):
+        capacity = max(capacity, 1)
+        self._file.truncate(capacity * 4)
+        self._buffer = np.memmap(
+            self._file, dtype=np.float32, mode="r+", shape=capacity
+        )
+        self._capacity = capacity
+
+    def _decode(self):
+        try:
+            for chunk in iter_pcm_chunks(
+                self.media_path, self.sample_rate, self.chunk_seconds
+            ):
+                start = self.decoded_samples
+                end = start + len(chunk)
+                if end > self._capacity:  # The container under-reported its duration
+                    with self._condition:
+                        self._resize(max(end, self._capacity * 2))
+                np.multiply(
+                    chunk,
+                    1 / 32768,
+                    out=self._buffer[start:end],
+                    casting="unsafe",
+                )
+                with self._condition:
+                    self.decoded_samples = end
+                    self._condition.notify_all()
+        except Exception as error:
+            self.error = error
+        finally:
+            with self._condition:
+                self.finished = True
+                self._condition.notify_all()
+
+    def wait_for(self, sample_count):
+        """
+        Block until at least sample_count samples are decoded (or the decode ends) and return the
+        number of samples available.
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self.decoded_samples >= sample_count or self.finished
+            )
+            if self.error is not None:
+                raise self.error
+            return self.decoded_samples
+
+    def audio(self, start_sample=0, end_sample=None):
+        """
+        Return a view of the decoded audio, waiting for the requested range to be decoded.
+        """
+        if end_sample is None:
+            self._thread.join()
+            end_sample = self.wait_for(float("inf"))
+        else:
+            end_sample = min(end_sample, self.wait_for(end_sample))
+        return self._buffer[start_sample:end_sample]
+
+    def result(self):
+        """
+        Wait for the whole file and return it as one float32 array backed by the temporary file.
+        """
+        return self.audio()
@@ -0,0 +1,81 @@
+import argparse
+import random
+import time
+from benchmarks.end_to_end import stand_in_for_config
+
+
+# The chunker summarise.py used before chunk_text, kept here as the baseline
+def batch_list(text, max_batch_size):
+    word_list = text.split()
+    word_batches = []
+    word_batch = ""
+    for word in word_list:
+        if len((word_batch + word).split()) <= max_batch_size:
+            word_batch += word + " "
+        else:
+            word_batches.append(word_batch)
+            word_batch = word + " "
+    word_batches.append(word_batch)
+
+    return word_batches
+
+
+def synthetic_transcript(word_count, seed=0):
+    """
+    A transcript laid out like transcribe_video.py's output, with turns of random length.
+    """
+    random.seed(seed)
+    turns = []
+    written_words = 0
+    while written_words < word_count:
+        turn_words = random.randint(5, 120)
+        speaker = random.randint(1, 4)
+        words = " ".join(f"word{random.randint(0, 5000)}" for _ in range(turn_words))
+        turns.append(f"Speaker {speaker} [0:00:00]\n{words}")
+        written_words += turn_words + 3
+    return "\n\n".join(turns)
+
+
+def time_call(function, *args, **kwargs):
+    start_time = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start_time, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Chunker Benchmark",
+        description="Compare summarise.chunk_text with the old quadratic batch_list on a synthetic transcript",
+    )
+    parser.add_argument(
+        "--words", type=int, default=20000, help="Words in the transcript"
+    )
+    parser.add_argument(
+        "--max-batch-size", type=int, default=4000, help="Maximum chunk size"
+    )
+    args = parser.parse_args()
+
+    # Only chunking is timed, so no API key is needed
+    stand_in_for_config()
+    import summarise
+
+    text = synthetic_transcript(args.words)
+    old_seconds, old_chunks = time_call(batch_list, text, args.max_batch_size)
+    new_seconds, new_chunks = time_call(
+        summarise.chunk_text,
+        text,
+        args.max_batch_size,
+        count_tokens=summarise.count_words,
+    )
+    print(f"batch_list: {len(old_chunks)} chunks in {old_seconds:.3f}s")
+    print(f"chunk_text (words): {len(new_chunks)} chunks in {new_seconds:.3f}s")
+    print(f"Speedup: {old_seconds / max(new_seconds, 1e-9):.1f}x")
+
+    token_counter = summarise.default_token_counter()
+    if token_counter is not summarise.count_words:
+        tokens_seconds, tokens_chunks = time_call(
+            summarise.chunk_text, text, args.max_batch_size
+        )
+        print(
+            f"chunk_text (model tokens): {len(tokens_chunks)} chunks in {tokens_seconds:.3f}s"
+        )
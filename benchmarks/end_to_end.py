@@ -0,0 +1,238 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import types
+from pathlib import Path
+from benchmarks.synthetic_audio import write_conversation
+from profiling import peak_rss_mb
+
+# Timings depend on the machine, so baselines are recorded locally with --save-baseline rather
+# than kept in the repository
+BASELINES_PATH = Path(__file__).parent.joinpath("baselines.json")
+STAGES = ["decode", "diarize", "transcribe", "summarise", "write"]
+
+
+def stand_in_for_config():
+    """
+    If there is no config.py, stand in for it so summarise.py can be imported without API keys.
+    """
+    try:
+        import config  # noqa: F401
+    except ImportError:
+        sys.modules["config"] = types.SimpleNamespace(
+            authorization="stub", hf_authorization=None
+        )
+
+
+def use_stub_llm(delay):
+    """
+    Serve the summariser from openai_stub.py, standing in for config.py if there is none, since
+    the stub needs no API key.
+    """
+    stand_in_for_config()
+    import openai
+    import openai_stub
+
+    server = openai_stub.start_stub_server(delay=delay)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1/"
+    os.environ["OPENAI_BASE_URL"] = base_url
+    openai.base_url = base_url
+    return server
+
+
+def run_benchmark(audio_path, audio_seconds, models, args):
+    """
+    Process one file through every stage and return the wall time of each stage, its real-time
+    factor and the peak RSS once it had finished.
+    """
+    import transcribe_video
+
+    stage_starts = {}
+    results = {}
+
+    def on_progress(event):
+        if event["status"] == "started":
+            stage_starts[event["stage"]] = time.perf_counter()
+        elif event["status"] == "finished":
+            seconds = time.perf_counter() - stage_starts[event["stage"]]
+            results[event["stage"]] = {
+                "seconds": round(seconds, 4),
+                "real_time_factor": round(seconds / audio_seconds, 6),
+                "peak_rss_mb": round(peak_rss_mb(), 1),
+            }
+
+    job = transcribe_video.make_job(str(audio_path), 0, 1, time.time())
+    job["on_progress"] = on_progress
+    start_time = time.perf_counter()
+    transcribe_video.process_file(job, models, args)
+    total_seconds = time.perf_counter() - start_time
+    results["total"] = {
+        "seconds": round(total_seconds, 4),
+        "real_time_factor": round(total_seconds / audio_seconds, 6),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    return results
+
+
+def check_regressions(results, baseline, tolerance, min_seconds=0.05):
+    """
+    Return a message for every stage that took more than `tolerance` longer than its baseline,
+    ignoring stages too short to time reliably, and for a peak RSS grown by more than `tolerance`.
+    """
+    regressions = []
+    for stage, result in results.items():
+        if stage not in baseline:
+            continue
+        baseline_seconds = baseline[stage]["seconds"]
+        if (
+            result["seconds"] > baseline_seconds * (1 + tolerance)
+            and result["seconds"] - baseline_seconds > min_seconds
+        ):
+            regressions.append(
+                f"{stage}: {result['seconds']:.3f}s against a baseline of {baseline_seconds:.3f}s"
+            )
+    if results["total"]["peak_rss_mb"] > baseline["total"]["peak_rss_mb"] * (
+        1 + tolerance
+    ):
+        regressions.append(
+            f"peak RSS: {results['total']['peak_rss_mb']:.0f} MB against a baseline of "
+            f"{baseline['total']['peak_rss_mb']:.0f} MB"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="End-to-End Benchmark",
+        description="Time every stage of transcribe_video.py on synthetic multi-speaker audio. "
+        "Options not listed here are passed on to transcribe_video.py, for example --mode batched.",
+    )
+    parser.add_argument(
+        "--seconds", type=float, default=600, help="Length of the synthetic recording"
+    )
+    parser.add_argument(
+        "--speakers", type=int, default=3, help="Number of synthetic voices (1 to 6)"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the audio")
+    parser.add_argument(
+        "--real-models",
+        action="store_true",
+        help="Use the real Whisper and pyannote models instead of stubs (needs config.py and the downloads)",
+    )
+    parser.add_argument(
+        "--real-llm",
+        action="store_true",
+        help="Summarise with the OpenAI API instead of openai_stub.py",
+    )
+    parser.add_argument(
+        "--stub-real-time-factor",
+        type=float,
+        default=0.01,
+        help="Seconds each stub model spends per second of audio",
+    )
+    parser.add_argument(
+        "--stub-llm-delay",
+        type=float,
+        default=0.05,
+        help="Seconds the stub LLM takes to answer each request",
+    )
+    parser.add_argument(
+        "--name",
+        help="Baseline name (defaults to one built from the benchmark settings)",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store the results as the baseline for these settings instead of comparing with it",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Fraction by which a stage may exceed its baseline before it counts as a regression",
+    )
+    parser.add_argument(
+        "--baselines", default=BASELINES_PATH, help="JSON file of stored baselines"
+    )
+    args, transcribe_options = parser.parse_known_args()
+
+    if not args.real_llm:
+        use_stub_llm(args.stub_llm_delay)
+    import transcribe_video
+
+    with tempfile.TemporaryDirectory() as directory:
+        audio_path = Path(directory).joinpath("synthetic.wav")
+        write_conversation(audio_path, args.seconds, args.speakers, args.seed)
+        audio_seconds = transcribe_video.media_duration(str(audio_path))
+
+        # Results are never read from or written to the caches, so every run does the full work
+        transcribe_args = transcribe_video.parse_arguments(
+            [
+                str(audio_path),
+                "--cache-dir",
+                directory,
+                "--no-cache",
+                "--no-llm-cache",
+                "--no-checkpoint",
+                *transcribe_options,
+            ]
+        )
+        transcribe_video.configure_run(transcribe_args)
+        if args.real_models:
+            models = transcribe_video.load_models(
+                whisper_settings=transcribe_video.whisper_settings(transcribe_args),
+                model_size=transcribe_args.model,
+            )
+        else:
+            from benchmarks.stub_models import stub_models
+
+            models = stub_models(args.stub_real_time_factor)
+        results = run_benchmark(audio_path, audio_seconds, models, transcribe_args)
+
+    print(f"{audio_seconds:.0f}s of audio, {args.speakers} speakers")
+    for stage in STAGES + ["total"]:
+        if stage in results:
+            result = results[stage]
+            print(
+                f"{stage:>10}: {result['seconds']:8.3f}s  RTF {result['real_time_factor']:.4f}  "
+                f"peak RSS {result['peak_rss_mb']:.0f} MB"
+            )
+
+    name = args.name or "-".join(
+        [
+            "real" if args.real_models else "stub",
+            "openai" if args.real_llm else "stub_llm",
+            f"{args.seconds:g}s",
+            f"{args.speakers}spk",
+            *[option.lstrip("-") for option in transcribe_options],
+        ]
+    )
+    baselines_path = Path(args.baselines)
+    baselines = (
+        json.loads(baselines_path.read_text()) if baselines_path.exists() else {}
+    )
+    if args.save_baseline:
+        baselines[name] = results
+        baselines_path.write_text(
+            json.dumps(baselines, indent=2, sort_keys=True) + "\n"
+        )
+        print(f"Saved baseline {name}")
+    elif name in baselines:
+        regressions = check_regressions(results, baselines[name], args.tolerance)
+        for regression in regressions:
+            print(f"Regression in {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against baseline {name}")
+    else:
+        print(
+            f"No baseline named {name} on this machine; record one by running again "
+            "with --save-baseline"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import time
+from types import SimpleNamespace
+import numpy as np
+from pyannote.core import Annotation, Segment
+import vad
+from benchmarks.synthetic_audio import SPEAKER_PITCHES
+
+SAMPLE_RATE = 16000
+WORDS_PER_SECOND = 2.5
+# Time each stub Whisper size takes relative to small, so model selection has something to choose
+STUB_MODEL_COSTS = {"tiny": 0.25, "base": 0.5, "small": 1.0, "medium": 3.0}
+
+
+# Stand-ins for the Whisper and pyannote models with the same call signatures. Each spends
+# `real_time_factor` seconds per second of audio, so a benchmark with stubs measures the code
+# around the models (decoding, slicing, grouping, chunking, summarising, writing) rather than them.
+def _stub_segments(start, end, segment_seconds=5.0):
+    segments = []
+    for segment_start in np.arange(start, end, segment_seconds):
+        segment_end = min(segment_start + segment_seconds, end)
+        word_count = max(1, int((segment_end - segment_start) * WORDS_PER_SECOND))
+        word_times = np.linspace(segment_start, segment_end, word_count + 1)
+        words = [
+            SimpleNamespace(start=word_start, end=word_end, word=f" word{index}")
+            for index, (word_start, word_end) in enumerate(
+                zip(word_times[:-1], word_times[1:])
+            )
+        ]
+        segments.append(
+            SimpleNamespace(
+                start=float(segment_start),
+                end=float(segment_end),
+                text="".join(word.word for word in words),
+                words=words,
+                avg_logprob=-0.3,
+                no_speech_prob=0.01,
+            )
+        )
+    return segments
+
+
+class StubWhisper:
+    def __init__(self, real_time_factor=0.01):
+        self.real_time_factor = real_time_factor
+
+    def transcribe(self, audio, **options):
+        seconds = len(audio) / SAMPLE_RATE
+        time.sleep(seconds * self.real_time_factor)
+        info = SimpleNamespace(duration=seconds, language="en")
+        return iter(_stub_segments(0.0, seconds)), info
+
+
+class StubBatchedWhisper:
+    def __init__(self, real_time_factor=0.01):
+        self.real_time_factor = real_time_factor
+
+    def transcribe(self, audio, clip_timestamps=None, **options):
+        clips = clip_timestamps or [{"start": 0, "end": len(audio)}]
+        segments = []
+        for clip in clips:
+            segments.extend(
+                _stub_segments(clip["start"] / SAMPLE_RATE, clip["end"] / SAMPLE_RATE)
+            )
+        seconds = sum(clip["end"] - clip["start"] for clip in clips) / SAMPLE_RATE
+        time.sleep(seconds * self.real_time_factor)
+        info = SimpleNamespace(duration=len(audio) / SAMPLE_RATE, language="en")
+        return iter(segments), info
+
+
+class StubDiarization:
+    """
+    Finds speech with the energy VAD and labels each stretch by the synthetic voice whose pitch is
+    closest to its dominant frequency, which separates the voices of benchmarks.synthetic_audio.
+    """
+
+    def __init__(self, real_time_factor=0.01):
+        self.real_time_factor = real_time_factor
+
+    def __call__(self, file, return_embeddings=False, **hints):
+        audio = file["waveform"][0].numpy()
+        time.sleep(len(audio) / file["sample_rate"] * self.real_time_factor)
+
+        annotation = Annotation(uri=file.get("uri"))
+        voice_labels = {}
+        for track, (start, end) in enumerate(vad.speech_regions(audio, SAMPLE_RATE)):
+            excerpt = audio[start : min(end, start + SAMPLE_RATE)]
+            spectrum = np.abs(np.fft.rfft(excerpt))
+            frequencies = np.fft.rfftfreq(len(excerpt), 1 / SAMPLE_RATE)
+            pitch = frequencies[np.argmax(spectrum[1:]) + 1]
+            voice = int(np.argmin(np.abs(np.array(SPEAKER_PITCHES) - pitch)))
+            label = voice_labels.setdefault(voice, f"SPEAKER_{len(voice_labels):02d}")
+            annotation[Segment(start / SAMPLE_RATE, end / SAMPLE_RATE), track] = label
+
+        if not return_embeddings:
+            return annotation
+        # One-hot "embeddings" by voice, ordered like annotation.labels()
+        label_voices = {label: voice for voice, label in voice_labels.items()}
+        embeddings = np.zeros(
+            (len(annotation.labels()), len(SPEAKER_PITCHES)), dtype=np.float32
+        )
+        for row, label in enumerate(annotation.labels()):
+            embeddings[row, label_voices[label]] = 1
+        return annotation, embeddings
+
+
+def stub_models(real_time_factor=0.01):
+    """
+    A models dictionary shaped like transcribe_video.load_models() built from the stubs.
+    """
+    return {
+        "whisper": {
+            model_size: StubWhisper(real_time_factor * cost)
+            for model_size, cost in STUB_MODEL_COSTS.items()
+        },
+        "batched_whisper": {
+            model_size: StubBatchedWhisper(real_time_factor * cost)
+            for model_size, cost in STUB_MODEL_COSTS.items()
+        },
+        "pipeline": StubDiarization(real_time_factor),
+    }
@@ -0,0 +1,63 @@
+import wave
+import numpy as np
+
+SAMPLE_RATE = 16000
+# Fundamental frequencies of the synthetic voices, far enough apart to tell them apart by pitch
+SPEAKER_PITCHES = [110, 150, 195, 240, 290, 340]
+
+
+def speaker_turn(pitch, seconds, rng, sample_rate=SAMPLE_RATE):
+    """
+    A voiced stand-in for speech: a few harmonics of the speaker's pitch with a syllable-rate
+    envelope and slight pitch drift.
+    """
+    time_axis = np.arange(int(seconds * sample_rate)) / sample_rate
+    drift = 1 + 0.02 * np.sin(2 * np.pi * rng.uniform(0.1, 0.3) * time_axis)
+    phase = 2 * np.pi * pitch * np.cumsum(drift) / sample_rate
+    harmonics = sum(np.sin(harmonic * phase) / harmonic for harmonic in range(1, 5))
+    syllables = np.abs(np.sin(np.pi * rng.uniform(3, 5) * time_axis)) ** 0.5
+    return (0.15 * harmonics * syllables).astype(np.float32)
+
+
+def write_conversation(
+    path,
+    seconds,
+    speakers=3,
+    seed=0,
+    min_turn=2.0,
+    max_turn=15.0,
+    sample_rate=SAMPLE_RATE,
+):
+    """
+    Write a mono 16-bit WAV of `speakers` synthetic voices taking turns, separated by quiet pauses
+    of at least a second, and return the true turns as (start, end, speaker) tuples. The file is
+    written one turn at a time, so recordings of many hours need little memory.
+    """
+    rng = np.random.default_rng(seed)
+    pitches = SPEAKER_PITCHES[:speakers]
+    turns = []
+    written = 0
+    speaker = 0
+    with wave.open(str(path), "wb") as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(sample_rate)
+        while written < seconds * sample_rate:
+            pause = (
+                rng.standard_normal(int(rng.uniform(1.0, 2.5) * sample_rate)) * 0.003
+            )
+            turn_seconds = rng.uniform(min_turn, max_turn)
+            voice = speaker_turn(pitches[speaker], turn_seconds, rng, sample_rate)
+            voice += rng.standard_normal(len(voice)).astype(np.float32) * 0.003
+            turn_start = (written + len(pause)) / sample_rate
+            turns.append((turn_start, turn_start + turn_seconds, speaker))
+
+            samples = np.concatenate([pause, voice])
+            file.writeframes(
+                (np.clip(samples, -1, 1) * 32767).astype(np.int16).tobytes()
+            )
+            written += len(samples)
+
+            if speakers > 1:  # Someone else speaks next
+                speaker = (speaker + rng.integers(1, speakers)) % speakers
+    return turns
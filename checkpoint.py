@@ -0,0 +1,103 @@
+import json
+import os
+import shutil
+from pathlib import Path
+
+
+def _write_json(path, data):
+    temporary_path = path.with_suffix(".tmp")
+    with open(temporary_path, "w") as file:
+        json.dump(data, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)  # A crash leaves either the old or the new file
+
+
+def _read_json(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+class Checkpoint:
+    """
+    Per-stage results of one file kept on disk while it is processed, so a re-run after a crash
+    resumes from the last completed stage (or transcribed group) instead of starting over.
+    """
+
+    def __init__(self, cache_dir, key):
+        self.directory = Path(cache_dir).joinpath("checkpoints", key)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.diarization_path = self.directory.joinpath("diarization.json")
+        self.groups_path = self.directory.joinpath("groups.jsonl")
+        self.transcript_path = self.directory.joinpath("transcript.json")
+        self.summary_path = self.directory.joinpath("summary.json")
+
+    # Diarization timeline, with the VAD time map when non-speech was removed before it
+    def save_diarization(self, master_dictionary, grouped_segments, time_map=None):
+        _write_json(
+            self.diarization_path,
+            {
+                "turns": master_dictionary,
+                "groups": grouped_segments,
+                "time_map": time_map,
+            },
+        )
+
+    def load_diarization(self):
+        data = _read_json(self.diarization_path)
+        if data is None:
+            return None
+        return data["turns"], data["groups"], data.get("time_map")
+
+    # Transcribed groups, appended one line at a time as each group completes
+    def append_group(self, group_index, transcription):
+        with open(self.groups_path, "a") as file:
+            file.write(
+                json.dumps({"group": group_index, "transcription": transcription})
+                + "\n"
+            )
+            file.flush()
+            os.fsync(file.fileno())
+
+    def load_groups(self):
+        """
+        The groups transcribed so far. A torn last line from a crash is cut off the file, so the
+        groups appended after resuming start on a line of their own.
+        """
+        completed_groups = {}
+        complete_length = 0
+        try:
+            with open(self.groups_path, "rb+") as file:
+                for line in file:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError("Unterminated line")
+                        record = json.loads(line)
+                    except ValueError:  # Includes json.JSONDecodeError
+                        file.truncate(complete_length)
+                        break
+                    completed_groups[record["group"]] = record["transcription"]
+                    complete_length += len(line)
+        except FileNotFoundError:
+            pass
+        return completed_groups
+
+    # The finished transcript of the whole file
+    def save_transcript(self, transcriptions):
+        _write_json(self.transcript_path, transcriptions)
+
+    def load_transcript(self):
+        return _read_json(self.transcript_path)
+
+    # Summary and actions
+    def save_summary(self, summary, actions):
+        _write_json(self.summary_path, {"summary": summary, "actions": actions})
+
+    def load_summary(self):
+        return _read_json(self.summary_path)
+
+    def remove(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class CompletionCache:
+    """
+    LLM completions stored in SQLite, keyed by a hash of the model, messages and request parameters,
+    evicted least recently used first once the stored responses exceed max_bytes.
+    Safe to share between threads; a forked process opens its own connection.
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    def _connect(self):
+        # A SQLite connection must not be used across a fork, so reconnect in a new process
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(
+                self.path, check_same_thread=False, timeout=30
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, response TEXT, size INTEGER, last_used REAL)"
+            )
+            self._connection.commit()
+            self._pid = os.getpid()
+        return self._connection
+
+    @staticmethod
+    def key(model, messages, **parameters):
+        key_material = json.dumps(
+            {"model": model, "messages": messages, "parameters": parameters},
+            sort_keys=True,
+        )
+        return hashlib.sha256(key_material.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT response FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            connection.execute(
+                "UPDATE completions SET last_used = ? WHERE key = ?",
+                (time.time(), key),
+            )
+            connection.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response):
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time()),
+            )
+            self._evict(connection)
+            connection.commit()
+
+    def _evict(self, connection):
+        (total_bytes,) = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM completions"
+        ).fetchone()
+        if total_bytes <= self.max_bytes:
+            return
+        for key, size in connection.execute(
+            "SELECT key, size FROM completions ORDER BY last_used"
+        ).fetchall():
+            connection.execute("DELETE FROM completions WHERE key = ?", (key,))
+            total_bytes -= size
+            if total_bytes <= self.max_bytes:
+                break
@@ -0,0 +1,34 @@
+import json
+import os
+from pathlib import Path
+
+PROFILE_FILE_NAME = "machine_profile.json"
+
+
+def profile_path(cache_dir):
+    return Path(cache_dir).joinpath(PROFILE_FILE_NAME)
+
+
+def load_profiles(cache_dir):
+    """
+    Return the Whisper settings tune.py found fastest on this machine, keyed by model size.
+    """
+    try:
+        with open(profile_path(cache_dir)) as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_profile(cache_dir, model_size, profile):
+    """
+    Store the settings for model_size, keeping the profiles of other model sizes.
+    """
+    path = profile_path(cache_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    profiles = load_profiles(cache_dir)
+    profiles[model_size] = profile
+    temporary_path = path.with_suffix(".tmp")
+    with open(temporary_path, "w") as file:
+        json.dump(profiles, file, indent=2)
+    os.replace(temporary_path, path)
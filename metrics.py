@@ -0,0 +1,196 @@
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+# The metrics of the file being processed in the current thread or asyncio task, so code deep in
+# the pipeline (a summary pass, an LLM request) can record into it without being passed it
+_current = contextvars.ContextVar("file_metrics", default=None)
+
+
+class FileMetrics:
+    """
+    Timing spans and counters for one file. Spans record their start relative to the file's first
+    span, so elapsed times restart with every file.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = str(file_path)
+        self.started = None  # Wall clock time of the first span
+        self._origin = None  # perf_counter of the first span
+        self.spans = []
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    # Jobs are pickled on their way to --workers processes, and a lock cannot be
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def elapsed(self):
+        return 0.0 if self._origin is None else time.perf_counter() - self._origin
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        with self._lock:
+            if self._origin is None:
+                self.started = time.time()
+                self._origin = time.perf_counter()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self.spans.append(
+                    {
+                        "name": name,
+                        "start": round(start - self._origin, 6),
+                        "seconds": round(seconds, 6),
+                        **attributes,
+                    }
+                )
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def stage_seconds(self):
+        return {
+            span["name"]: span["seconds"] for span in self.spans if span.get("stage")
+        }
+
+    def as_record(self):
+        """
+        One JSON-serialisable record of the file: its spans, counters and per-stage real-time factors.
+        """
+        audio_seconds = self.counters.get("audio_seconds", 0)
+        stage_seconds = self.stage_seconds()
+        return {
+            "file_path": self.file_path,
+            "started": self.started,
+            "seconds": round(self.elapsed(), 6),
+            "counters": dict(self.counters),
+            "stage_seconds": stage_seconds,
+            "real_time_factor": {
+                stage: round(seconds / audio_seconds, 6)
+                for stage, seconds in stage_seconds.items()
+                if audio_seconds
+            },
+            "spans": list(self.spans),
+        }
+
+
+@contextlib.contextmanager
+def activate(file_metrics):
+    """
+    Make file_metrics the target of span() and count() in this thread or task.
+    """
+    token = _current.set(file_metrics)
+    try:
+        yield file_metrics
+    finally:
+        _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+def span(name, **attributes):
+    """
+    Time the enclosed block as a span of the active file, or do nothing when there is none.
+    """
+    file_metrics = _current.get()
+    if file_metrics is None:
+        return contextlib.nullcontext()
+    return file_metrics.span(name, **attributes)
+
+
+def count(name, amount=1):
+    file_metrics = _current.get()
+    if file_metrics is not None:
+        file_metrics.count(name, amount)
+
+
+def append_record(path, record):
+    """
+    Append a record as one JSON line. The line goes out in a single write on a file opened for
+    appending, so forked workers writing to the same file do not interleave.
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    line = (json.dumps(record) + "\n").encode("utf-8")
+    descriptor = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(descriptor, line)
+    finally:
+        os.close(descriptor)
+
+
+class Registry:
+    """
+    Totals over every file recorded in this process, rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.counters = {}
+        self.stage_seconds = {}
+        self.last_real_time_factor = {}
+        self._lock = threading.Lock()
+
+    def observe(self, record):
+        with self._lock:
+            self.files += 1
+            for name, value in record["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for stage, seconds in record["stage_seconds"].items():
+                self.stage_seconds[stage] = self.stage_seconds.get(stage, 0) + seconds
+            self.last_real_time_factor.update(record["real_time_factor"])
+
+    def render(self):
+        with self._lock:
+            lines = [
+                "# HELP transcribe_video_files_total Files processed.",
+                "# TYPE transcribe_video_files_total counter",
+                f"transcribe_video_files_total {self.files}",
+            ]
+            for name, value in sorted(self.counters.items()):
+                lines += [
+                    f"# TYPE transcribe_video_{name}_total counter",
+                    f"transcribe_video_{name}_total {value}",
+                ]
+            lines.append("# TYPE transcribe_video_stage_seconds_total counter")
+            for stage, seconds in sorted(self.stage_seconds.items()):
+                lines.append(
+                    f'transcribe_video_stage_seconds_total{{stage="{stage}"}} {seconds}'
+                )
+            lines += [
+                "# HELP transcribe_video_real_time_factor Seconds per second of audio of the last file.",
+                "# TYPE transcribe_video_real_time_factor gauge",
+            ]
+            for stage, factor in sorted(self.last_real_time_factor.items()):
+                lines.append(
+                    f'transcribe_video_real_time_factor{{stage="{stage}"}} {factor}'
+                )
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Write the metrics atomically, for example for node_exporter's textfile collector.
+        """
+        path = Path(path)
+        temporary_path = path.with_suffix(".tmp")
+        temporary_path.write_text(self.render())
+        os.replace(temporary_path, path)
+
+
+registry = Registry()
@@ -0,0 +1,139 @@
+import json
+import os
+import statistics
+import time
+from pathlib import Path
+import metrics
+
+# From the fastest and least accurate to the slowest and most accurate
+MODEL_SIZES = ["tiny", "base", "small", "medium"]
+HISTORY_FILE_NAME = "throughput_history.json"
+HISTORY_LENGTH = 20  # Measurements kept per mode and model size
+MIN_MEASURED_SECONDS = 30  # Less audio than this gives too noisy a real-time factor
+# Rough CPU real-time factors at beam size 5, used until a size has been measured on this host
+DEFAULT_REAL_TIME_FACTORS = {"tiny": 0.05, "base": 0.1, "small": 0.3, "medium": 0.9}
+
+
+class ThroughputHistory:
+    """
+    The real-time factors (seconds taken per second of audio) measured on this host for each
+    transcription mode and model size, kept in the cache directory.
+    """
+
+    def __init__(self, cache_dir):
+        self.path = Path(cache_dir).joinpath(HISTORY_FILE_NAME)
+        self.samples = self._read()
+
+    def _read(self):
+        try:
+            with open(self.path) as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def real_time_factor(self, mode, model_size):
+        """
+        The median of the recent measurements, or a rough default for a size never measured.
+        """
+        samples = self.samples.get(mode, {}).get(model_size)
+        if not samples:
+            return DEFAULT_REAL_TIME_FACTORS[model_size]
+        return statistics.median(samples)
+
+    def record(self, mode, model_size, audio_seconds, seconds):
+        if audio_seconds < MIN_MEASURED_SECONDS:
+            return
+        # Re-read first to keep what other processes recorded in the meantime
+        self.samples = self._read()
+        samples = self.samples.setdefault(mode, {}).setdefault(model_size, [])
+        samples.append(round(seconds / audio_seconds, 6))
+        del samples[:-HISTORY_LENGTH]
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temporary_path, "w") as file:
+            json.dump(self.samples, file, indent=2)
+        os.replace(temporary_path, self.path)
+
+
+def choose_model_size(history, mode, target_real_time_factor, slowdown=1.0, sizes=None):
+    """
+    The most accurate size expected to keep within the target, or the fastest if none is.
+    slowdown scales the history, for when the host is running slower than it usually does.
+    """
+    sizes = sizes or MODEL_SIZES
+    for model_size in reversed(sizes):
+        expected = history.real_time_factor(mode, model_size) * slowdown
+        if expected <= target_real_time_factor:
+            return model_size
+    return sizes[0]
+
+
+class ModelSchedule:
+    """
+    The model size to transcribe a file's remaining audio with. Without a deadline it is always
+    model_size. With one (a time.time() value) the most accurate size expected to finish in time is
+    chosen, and once enough audio has been transcribed to measure the pace, a size falling behind is
+    swapped for a smaller one for the rest of the file.
+    """
+
+    def __init__(self, history, mode, model_size, audio_seconds, deadline=None):
+        self.history = history
+        self.mode = mode
+        self.remaining_audio = audio_seconds
+        self.deadline = deadline
+        self.used = {}  # Model size: [audio seconds, seconds taken]
+        self.model_size = model_size
+        if deadline is not None:
+            self.model_size = choose_model_size(
+                history, mode, self.target_real_time_factor()
+            )
+            print(
+                f"Transcribing {audio_seconds:.0f}s of audio with the {self.model_size} model "
+                f"to finish within {max(deadline - time.time(), 0):.0f}s"
+            )
+
+    def target_real_time_factor(self):
+        """
+        The real-time factor that would finish the remaining audio exactly at the deadline.
+        """
+        return max(self.deadline - time.time(), 0) / max(self.remaining_audio, 1e-9)
+
+    def record(self, audio_seconds, seconds):
+        """
+        Add the time taken to transcribe some audio. Returns True if the rest of the file is to be
+        transcribed with a smaller model.
+        """
+        used = self.used.setdefault(self.model_size, [0.0, 0.0])
+        used[0] += audio_seconds
+        used[1] += seconds
+        self.remaining_audio = max(self.remaining_audio - audio_seconds, 0.0)
+        metrics.count(f"audio_seconds_{self.model_size}", audio_seconds)
+        if (
+            self.deadline is None
+            or used[0] < MIN_MEASURED_SECONDS
+            or self.remaining_audio <= 0
+        ):
+            return False
+
+        measured = used[1] / used[0]
+        target = self.target_real_time_factor()
+        smaller_sizes = MODEL_SIZES[: MODEL_SIZES.index(self.model_size)]
+        if measured <= target or not smaller_sizes:
+            return False
+        slowdown = measured / self.history.real_time_factor(self.mode, self.model_size)
+        previous_size = self.model_size
+        self.model_size = choose_model_size(
+            self.history, self.mode, target, slowdown, smaller_sizes
+        )
+        metrics.count("model_downgrades")
+        print(
+            f"The {previous_size} model is transcribing at {measured:.2f}s per second of audio "
+            f"but {target:.2f} is needed, so the remaining {self.remaining_audio:.0f}s will use "
+            f"the {self.model_size} model"
+        )
+        return True
+
+    def save_history(self):
+        for model_size, (audio_seconds, seconds) in self.used.items():
+            self.history.record(self.mode, model_size, audio_seconds, seconds)
@@ -0,0 +1,140 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# A minimal OpenAI-compatible chat completions server for exercising the summariser offline.
+# Point the client at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1
+class StubHandler(BaseHTTPRequestHandler):
+    delay = 0.0  # Seconds to wait before answering, to stand in for model latency
+    fail_rate = 0.0  # Fraction of requests answered with fail_status instead
+    fail_status = 429
+    retry_after = None  # Retry-After header sent with failures, in seconds
+    requests_received = 0
+
+    def log_message(self, format, *args):
+        pass  # Keep the console quiet
+
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        type(self).requests_received += 1
+        time.sleep(self.delay)
+        if random.random() < self.fail_rate:
+            headers = {}
+            if self.retry_after is not None:
+                headers["Retry-After"] = str(self.retry_after)
+            self._send_json(
+                self.fail_status,
+                {"error": {"message": "Stub failure", "type": "stub_error"}},
+                headers,
+            )
+            return
+
+        prompt = request.get("messages", [{}])[-1].get("content", "")
+        prompt_words = len(prompt.split())
+        content = f"Stub completion of a {prompt_words} word prompt."
+        if request.get("response_format", {}).get("type") == "json_object":
+            content = json.dumps({"summary": content, "actions": ["Stub action"]})
+        self._send_json(
+            200,
+            {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "stub"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_words,
+                    "completion_tokens": len(content.split()),
+                    "total_tokens": prompt_words + len(content.split()),
+                },
+            },
+        )
+
+
+def start_stub_server(
+    port=0, delay=0.0, fail_rate=0.0, fail_status=429, retry_after=None
+):
+    """
+    Start the stub in a background thread and return the server; its base URL is
+    f"http://127.0.0.1:{server.server_address[1]}/v1" and server.RequestHandlerClass.requests_received
+    counts the requests. Call server.shutdown() to stop it.
+    """
+    handler = type(
+        "ConfiguredStubHandler",
+        (StubHandler,),
+        {
+            "delay": delay,
+            "fail_rate": fail_rate,
+            "fail_status": fail_status,
+            "retry_after": retry_after,
+        },
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="OpenAI Stub",
+        description="Serve canned chat completions on an OpenAI-compatible endpoint for offline testing",
+    )
+    parser.add_argument("--port", type=int, default=8001, help="Port to listen on")
+    parser.add_argument(
+        "--delay",
+        type=float,
+        default=0.0,
+        help="Seconds to wait before answering each request",
+    )
+    parser.add_argument(
+        "--fail-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests answered with an error instead of a completion",
+    )
+    parser.add_argument(
+        "--fail-status",
+        type=int,
+        default=429,
+        help="HTTP status of the failures, for example 429 (rate limited) or 500",
+    )
+    parser.add_argument(
+        "--retry-after",
+        type=float,
+        help="Send a Retry-After header with this many seconds on failures",
+    )
+    args = parser.parse_args()
+
+    server = start_stub_server(
+        args.port, args.delay, args.fail_rate, args.fail_status, args.retry_after
+    )
+    print(f"Serving on http://127.0.0.1:{server.server_address[1]}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,121 @@
+import contextlib
+import cProfile
+import io
+import pstats
+import resource
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+except ImportError:  # Optional: cProfile alone is used without it
+    SamplingProfiler = None
+
+TOP_ALLOCATIONS = 10
+TOP_FUNCTIONS = 25
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process so far, in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class StageProfiler:
+    """
+    Profiles each stage of one file with cProfile and tracemalloc, and with pyinstrument's sampling
+    profiler when it is installed. Each stage's pstats file is written to
+    <output_dir>/<name>.<stage>.pstats, and write_report() writes <output_dir>/<name>.profile.txt.
+    Only Python-level allocations are traced (NumPy buffers included), not memory allocated
+    natively by CTranslate2 or PyTorch, so the report also gives the process's peak RSS.
+    """
+
+    def __init__(self, output_dir, name):
+        self.output_dir = Path(output_dir)
+        self.name = name
+        self.stages = []
+
+    def _path(self, suffix):
+        return self.output_dir.joinpath(f"{self.name}.{suffix}")
+
+    @contextlib.contextmanager
+    def profile(self, stage_name):
+        # Tracing stays on once started, since stages of different files may overlap
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        allocated_before = tracemalloc.get_traced_memory()[0]
+
+        # Python 3.12+ allows one active cProfile per process, which overlapping stages can hit
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            profiler = None
+        sampler = SamplingProfiler(async_mode="disabled") if SamplingProfiler else None
+        if sampler is not None:
+            sampler.start()
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if sampler is not None:
+                sampler.stop()
+            if profiler is not None:
+                profiler.disable()
+            peak_bytes = tracemalloc.get_traced_memory()[1] - allocated_before
+            top_allocations = tracemalloc.take_snapshot().statistics("lineno")[
+                :TOP_ALLOCATIONS
+            ]
+
+            stage = {
+                "stage": stage_name,
+                "seconds": seconds,
+                "peak_allocated_mb": peak_bytes / (1024 * 1024),
+                "peak_rss_mb": peak_rss_mb(),
+                "top_allocations": [str(statistic) for statistic in top_allocations],
+                "functions": None,
+            }
+            if profiler is not None:
+                profiler.dump_stats(self._path(f"{stage_name}.pstats"))
+                functions = io.StringIO()
+                pstats.Stats(profiler, stream=functions).sort_stats(
+                    "cumulative"
+                ).print_stats(TOP_FUNCTIONS)
+                stage["functions"] = functions.getvalue()
+            if sampler is not None:
+                self._path(f"{stage_name}.pyinstrument.txt").write_text(
+                    sampler.output_text(unicode=True, color=False)
+                )
+            self.stages.append(stage)
+
+    def write_report(self):
+        lines = [f"Profile of {self.name}", ""]
+        for stage in self.stages:
+            lines.append(
+                f"{stage['stage']}: {stage['seconds']:.2f}s, peak Python allocations "
+                f"{stage['peak_allocated_mb']:.1f} MB, peak RSS so far {stage['peak_rss_mb']:.0f} MB"
+            )
+        for stage in self.stages:
+            lines += [
+                "",
+                f"== {stage['stage']} ==",
+                "",
+                "Largest allocations still held:",
+            ]
+            lines += [f"  {allocation}" for allocation in stage["top_allocations"]]
+            lines.append("")
+            lines.append(
+                stage["functions"]
+                or "No cProfile data: another stage was being profiled at the same time"
+            )
+        path = self._path("profile.txt")
+        path.write_text("\n".join(lines) + "\n")
+        return path
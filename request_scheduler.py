@@ -0,0 +1,142 @@
+import asyncio
+import random
+import threading
+import time
+import openai
+import metrics
+
+# Errors worth retrying: rate limits, server errors and network trouble. Anything else (a bad
+# request, a wrong API key) fails straight away.
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,  # Includes openai.APITimeoutError
+)
+
+
+class RetryBudgetExceeded(Exception):
+    pass
+
+
+class TokenBucket:
+    """
+    Allows `rate_per_minute` units per minute with bursts up to one minute's worth. A reservation is
+    taken immediately (the bucket may go into debt) and returns how long the caller must wait first,
+    so the same bucket serves threads and asyncio tasks.
+    """
+
+    def __init__(self, rate_per_minute):
+        self.capacity = rate_per_minute
+        self.available = rate_per_minute
+        self.refill_per_second = rate_per_minute / 60
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount):
+        with self._lock:
+            now = time.monotonic()
+            self.available = min(
+                self.capacity,
+                self.available + (now - self.updated) * self.refill_per_second,
+            )
+            self.updated = now
+            # A request bigger than the bucket waits for a full bucket
+            self.available -= min(amount, self.capacity)
+            if self.available >= 0:
+                return 0.0
+            return -self.available / self.refill_per_second
+
+
+class RequestScheduler:
+    """
+    Paces API requests with token buckets for requests and tokens per minute (0 disables a limit),
+    and retries retryable errors with exponential backoff and full jitter, honouring Retry-After.
+    Each request gets at most max_attempts tries, and all requests together share retry_budget retries
+    until reset_retries() starts a new budget.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute=500,
+        tokens_per_minute=0,
+        max_attempts=6,
+        retry_budget=100,
+        base_delay=1.0,
+        max_delay=60.0,
+    ):
+        self.request_bucket = (
+            TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self.token_bucket = (
+            TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        )
+        self.max_attempts = max_attempts
+        self.retry_budget = retry_budget
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def reset_retries(self):
+        """
+        Start a new retry budget, e.g. for the next job of a long-running service. The rate limits
+        carry on as they are.
+        """
+        with self._lock:
+            self.retries = 0
+
+    def _admission_delay(self, estimated_tokens):
+        delay = 0.0
+        if self.request_bucket is not None:
+            delay = max(delay, self.request_bucket.reserve(1))
+        if self.token_bucket is not None:
+            delay = max(delay, self.token_bucket.reserve(estimated_tokens))
+        return delay
+
+    @staticmethod
+    def _retry_after(error):
+        response = getattr(error, "response", None)
+        if response is None:
+            return 0.0
+        try:
+            if "retry-after-ms" in response.headers:
+                return float(response.headers["retry-after-ms"]) / 1000
+            return float(response.headers.get("retry-after", 0))
+        except ValueError:  # An HTTP date rather than seconds
+            return 0.0
+
+    def _retry_delay(self, error, attempt):
+        """
+        Count a retry against the budget and return how long to wait, or raise if none are left.
+        """
+        with self._lock:
+            if attempt + 1 >= self.max_attempts or self.retries >= self.retry_budget:
+                raise RetryBudgetExceeded(
+                    f"Giving up after {attempt + 1} attempts ({self.retries} retries used in total)"
+                ) from error
+            self.retries += 1
+        metrics.count("llm_retries")
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        return max(backoff, self._retry_after(error))
+
+    def call(self, request, estimated_tokens=0):
+        """
+        Run request() when the rate limits allow, retrying retryable errors.
+        """
+        for attempt in range(self.max_attempts):
+            time.sleep(self._admission_delay(estimated_tokens))
+            try:
+                return request()
+            except RETRYABLE_ERRORS as error:
+                time.sleep(self._retry_delay(error, attempt))
+
+    async def call_async(self, request, estimated_tokens=0):
+        """
+        Await request() when the rate limits allow, retrying retryable errors.
+        """
+        for attempt in range(self.max_attempts):
+            await asyncio.sleep(self._admission_delay(estimated_tokens))
+            try:
+                return await request()
+            except RETRYABLE_ERRORS as error:
+                await asyncio.sleep(self._retry_delay(error, attempt))
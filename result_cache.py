@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+DEFAULT_CACHE_DIR = Path.home().joinpath(".cache", "transcribe_video")
+
+
+def hash_file(file_path, block_size=1024 * 1024):
+    """
+    Return the SHA-256 of a file's content, read in blocks so large recordings are never held in memory.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(content_hash, settings):
+    """
+    Combine a media content hash with every setting that changes the output into one key.
+    """
+    key_material = json.dumps(
+        {"content": content_hash, "settings": settings}, sort_keys=True
+    )
+    return hashlib.sha256(key_material.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    A directory of finished results, one JSON file per key, evicted least recently used first
+    once the directory grows beyond max_bytes. A hit refreshes the file's modification time.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=1024 * 1024 * 1024):
+        self.directory = Path(cache_dir).joinpath("results")
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return self.directory.joinpath(f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path) as file:
+                result = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        os.utime(path)  # Mark as recently used
+        return result
+
+    def put(self, key, result):
+        path = self._path(key)
+        temporary_path = path.with_suffix(".tmp")
+        with open(temporary_path, "w") as file:
+            json.dump(result, file)
+        os.replace(temporary_path, path)  # Readers never see a half-written entry
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for path in self.directory.glob("*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:  # Removed by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total_bytes -= size
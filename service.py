@@ -0,0 +1,199 @@
+import json
+import os
+import queue
+import socketserver
+import stat
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class JobRecord:
+    """
+    A submitted file, its status and the progress events recorded while it is processed.
+    """
+
+    def __init__(self, file_path):
+        self.id = uuid.uuid4().hex
+        self.file_path = file_path
+        self.submitted = time.time()
+        self.status = "queued"  # queued, running, done or failed
+        self.output_path = None
+        self.error = None
+        self.events = []
+        self.condition = threading.Condition()
+        self.add_event({"status": "queued"})
+
+    def add_event(self, event):
+        with self.condition:
+            self.events.append({"time": time.time(), **event})
+            self.condition.notify_all()
+
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    def as_dict(self):
+        return {
+            "job_id": self.id,
+            "file_path": self.file_path,
+            "status": self.status,
+            "output_path": self.output_path,
+            "error": self.error,
+        }
+
+
+class JobService:
+    """
+    Runs submitted files one at a time through process(file_path, on_progress, submitted), which
+    returns the output path. The models stay loaded between jobs.
+    """
+
+    def __init__(self, process):
+        self.process = process
+        self.jobs = {}
+        self.pending = queue.Queue()
+        threading.Thread(target=self._run, name="service-worker", daemon=True).start()
+
+    def submit(self, file_path):
+        record = JobRecord(file_path)
+        self.jobs[record.id] = record
+        self.pending.put(record)
+        return record
+
+    def _run(self):
+        while True:
+            record = self.pending.get()
+            record.status = "running"
+            record.add_event({"status": "running"})
+            try:
+                record.output_path = str(
+                    self.process(record.file_path, record.add_event, record.submitted)
+                )
+                record.status = "done"
+                record.add_event({"status": "done", "output_path": record.output_path})
+            except Exception as error:
+                record.error = repr(error)
+                record.status = "failed"
+                record.add_event({"status": "failed", "error": record.error})
+
+
+def make_handler(service, render_metrics=None):
+    class JobHandler(BaseHTTPRequestHandler):
+        """
+        POST /jobs with {"file_path": ...} queues a file and returns its job ID.
+        GET /jobs/<id> returns the job's status.
+        GET /jobs/<id>/events streams its progress events as JSON lines until it finishes.
+        GET /metrics returns render_metrics() as Prometheus text, when it is given.
+        """
+
+        def log_message(self, format, *args):
+            pass  # Keep the console for job output
+
+        def _send_json(self, status, body):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/jobs":
+                self._send_json(404, {"error": "Unknown path"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                file_path = json.loads(self.rfile.read(length))["file_path"]
+            except (ValueError, KeyError, TypeError):
+                self._send_json(400, {"error": 'Expected {"file_path": "..."}'})
+                return
+            if not os.path.isfile(file_path):
+                self._send_json(400, {"error": f"No such file: {file_path}"})
+                return
+            record = service.submit(file_path)
+            self._send_json(202, record.as_dict())
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/metrics" and render_metrics is not None:
+                payload = render_metrics().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+            parts = self.path.strip("/").split("/")
+            if len(parts) < 2 or parts[0] != "jobs" or parts[1] not in service.jobs:
+                self._send_json(404, {"error": "Unknown job"})
+                return
+            record = service.jobs[parts[1]]
+            if len(parts) == 2:
+                self._send_json(200, record.as_dict())
+            elif parts[2:] == ["events"]:
+                self._stream_events(record)
+            else:
+                self._send_json(404, {"error": "Unknown path"})
+
+        def _stream_events(self, record):
+            # HTTP/1.0 without a Content-Length: the stream ends when the connection closes
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            sent = 0
+            while True:
+                with record.condition:
+                    record.condition.wait_for(
+                        lambda: len(record.events) > sent or record.finished()
+                    )
+                    new_events = record.events[sent:]
+                    finished = record.finished()
+                try:
+                    for event in new_events:
+                        self.wfile.write((json.dumps(event) + "\n").encode("utf-8"))
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    return  # The client stopped listening
+                sent += len(new_events)
+                if finished and sent == len(record.events):
+                    return
+
+    return JobHandler
+
+
+class ThreadingUnixHTTPServer(
+    socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("unix", 0)  # BaseHTTPRequestHandler expects a host and port
+
+
+def serve(process, port=8765, socket_path=None, render_metrics=None):
+    """
+    Serve the job API on 127.0.0.1:port, or on a Unix socket, until interrupted.
+    """
+    service = JobService(process)
+    handler = make_handler(service, render_metrics)
+    if socket_path:
+        if os.path.exists(socket_path):
+            if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                raise FileExistsError(
+                    f"{socket_path} already exists and is not a socket"
+                )
+            os.remove(socket_path)  # Left behind by a previous run
+        server = ThreadingUnixHTTPServer(socket_path, handler)
+        print(f"Serving jobs on unix socket {socket_path}")
+    else:
+        server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        print(f"Serving jobs on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
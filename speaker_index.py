@@ -0,0 +1,244 @@
+import argparse
+import os
+from pathlib import Path
+import numpy as np
+import ffmpeg
+import torch
+from scipy.optimize import linear_sum_assignment
+import result_cache
+
+SAMPLE_RATE = 16000
+SPEAKER_MODEL_SOURCE = "speechbrain/spkrec-xvect-voxceleb"
+SPEAKER_MODEL_DIR = Path(__file__).parent.joinpath(
+    "pretrained_models", "spkrec-xvect-voxceleb"
+)
+DEFAULT_INDEX_PATH = Path(result_cache.DEFAULT_CACHE_DIR).joinpath("speaker_index.npz")
+MAX_EMBEDDING_SECONDS = 120  # Longest turns first, up to this much speech per speaker
+
+
+def load_encoder():
+    """
+    Load the x-vector speaker embedding model kept in pretrained_models/spkrec-xvect-voxceleb.
+    """
+    try:
+        from speechbrain.inference.speaker import EncoderClassifier
+    except ImportError:  # speechbrain before 1.0
+        from speechbrain.pretrained import EncoderClassifier
+
+    return EncoderClassifier.from_hparams(
+        source=SPEAKER_MODEL_SOURCE,
+        savedir=str(SPEAKER_MODEL_DIR),
+        run_opts={"device": "cpu"},
+    )
+
+
+def embed(encoder, audio):
+    """
+    Return the unit-length x-vector of a float32 16 kHz mono NumPy array.
+    """
+    with torch.inference_mode():
+        embedding = encoder.encode_batch(torch.from_numpy(np.asarray(audio))[None])
+    embedding = embedding.squeeze().cpu().numpy().astype(np.float32)
+    return embedding / max(np.linalg.norm(embedding), 1e-10)
+
+
+def speaker_embeddings(encoder, audio, master_dictionary, sample_rate=SAMPLE_RATE):
+    """
+    One embedding per speaker label, from that speaker's longest turns joined together.
+    Returns (labels, embeddings matrix).
+    """
+    turns_by_label = {}
+    for turn in master_dictionary:
+        turns_by_label.setdefault(turn["label"], []).append(turn)
+
+    labels = sorted(turns_by_label)
+    embeddings = []
+    for label in labels:
+        longest_first = sorted(
+            turns_by_label[label], key=lambda turn: turn["start"] - turn["end"]
+        )
+        pieces = []
+        remaining = MAX_EMBEDDING_SECONDS * sample_rate
+        for turn in longest_first:
+            piece = audio[
+                int(turn["start"] * sample_rate) : int(turn["end"] * sample_rate)
+            ]
+            pieces.append(piece[:remaining])
+            remaining -= len(pieces[-1])
+            if remaining <= 0:
+                break
+        embeddings.append(embed(encoder, np.concatenate(pieces)))
+    return labels, np.array(embeddings, dtype=np.float32).reshape(len(labels), -1)
+
+
+class SpeakerIndex:
+    """
+    Enrolled speakers as a names array and a matrix of unit embeddings, one row per enrollment,
+    stored in a .npz file. A person enrolled several times keeps every row and matches on the best.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = Path(path)
+        self.names = np.array([], dtype=str)
+        self.embeddings = np.zeros((0, 0), dtype=np.float32)
+        if self.path.exists():
+            with np.load(self.path) as data:
+                self.names = data["names"]
+                self.embeddings = data["embeddings"]
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self.path.with_suffix(".tmp.npz")
+        np.savez(temporary_path, names=self.names, embeddings=self.embeddings)
+        os.replace(temporary_path, self.path)
+
+    def enroll(self, name, embedding):
+        embedding = np.asarray(embedding, dtype=np.float32)[None]
+        if len(self.names) == 0:
+            self.embeddings = embedding
+        else:
+            self.embeddings = np.concatenate([self.embeddings, embedding])
+        self.names = np.append(self.names, name)
+
+    def remove(self, name):
+        keep = self.names != name
+        self.names = self.names[keep]
+        self.embeddings = self.embeddings[keep]
+
+    def identify(self, embeddings, threshold=0.5):
+        """
+        Return the enrolled name for each row of embeddings, or None where no enrolled speaker is
+        similar enough. Two rows are never given the same name.
+        """
+        names = [None] * len(embeddings)
+        if len(self.names) == 0 or len(embeddings) == 0:
+            return names
+
+        # Cosine similarity of every embedding to every enrollment, then the best row per person
+        similarity = embeddings @ self.embeddings.T
+        people, person_index = np.unique(self.names, return_inverse=True)
+        person_similarity = np.full((len(people), len(embeddings)), -np.inf)
+        np.maximum.at(person_similarity, person_index, similarity.T)
+        person_similarity = person_similarity.T
+
+        rows, columns = linear_sum_assignment(-person_similarity)
+        for row, column in zip(rows, columns):
+            if person_similarity[row, column] >= threshold:
+                names[row] = str(people[column])
+        return names
+
+
+def load_cluster_embeddings(path):
+    """
+    Return {label: embedding} saved for one file's speakers, or None if there is none.
+    """
+    try:
+        with np.load(path) as data:
+            return dict(zip(data["labels"].tolist(), data["embeddings"]))
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+
+
+def save_cluster_embeddings(path, labels, embeddings):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_suffix(".tmp.npz")
+    np.savez(temporary_path, labels=np.array(labels, dtype=str), embeddings=embeddings)
+    os.replace(temporary_path, path)
+
+
+def name_speakers(
+    encoder,
+    index,
+    audio,
+    master_dictionary,
+    grouped_segments,
+    embeddings_path=None,
+    threshold=0.5,
+):
+    """
+    Replace "Speaker N" labels with the names of enrolled speakers where they match. The embeddings
+    of the file's speakers are cached at embeddings_path so they are only computed once.
+    """
+    cached = load_cluster_embeddings(embeddings_path) if embeddings_path else None
+    labels = sorted({turn["label"] for turn in master_dictionary})
+    if cached is not None and set(cached) == set(labels):
+        embeddings = np.array([cached[label] for label in labels])
+    else:
+        labels, embeddings = speaker_embeddings(encoder, audio, master_dictionary)
+        if embeddings_path:
+            save_cluster_embeddings(embeddings_path, labels, embeddings)
+
+    renames = {
+        label: name
+        for label, name in zip(labels, index.identify(embeddings, threshold))
+        if name is not None
+    }
+    for turn in master_dictionary:
+        turn["label"] = renames.get(turn["label"], turn["label"])
+    for group in grouped_segments:
+        group["speaker"] = renames.get(group["speaker"], group["speaker"])
+    return renames
+
+
+def decode_clip(media_path, start=None, end=None, sample_rate=SAMPLE_RATE):
+    """
+    Decode all of a media file, or the part from start to end seconds, as float32 mono.
+    """
+    input_options = {}
+    if start is not None:
+        input_options["ss"] = start
+    if end is not None:
+        input_options["t"] = end - (start or 0)
+    out, _ = (
+        ffmpeg.input(media_path, **input_options)
+        .output("pipe:1", format="f32le", acodec="pcm_f32le", ac=1, ar=sample_rate)
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+    return np.frombuffer(out, dtype=np.float32)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Speaker Index",
+        description="Enroll known speakers so transcripts name them instead of numbering them",
+    )
+    parser.add_argument(
+        "--index",
+        default=DEFAULT_INDEX_PATH,
+        help="Path of the speaker index (.npz)",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    enroll_parser = commands.add_parser(
+        "enroll", help="Add a recording of one person speaking to the index"
+    )
+    enroll_parser.add_argument("name", help="The name to use in transcripts")
+    enroll_parser.add_argument(
+        "media_path", help="A media file in which only this person speaks"
+    )
+    enroll_parser.add_argument(
+        "--start", type=float, help="Start of the person's speech in seconds"
+    )
+    enroll_parser.add_argument(
+        "--end", type=float, help="End of the person's speech in seconds"
+    )
+    remove_parser = commands.add_parser(
+        "remove", help="Remove every enrollment of a person"
+    )
+    remove_parser.add_argument("name")
+    commands.add_parser("list", help="List the enrolled people")
+    args = parser.parse_args()
+
+    index = SpeakerIndex(args.index)
+    if args.command == "enroll":
+        audio = decode_clip(args.media_path, args.start, args.end)
+        index.enroll(args.name, embed(load_encoder(), audio))
+        index.save()
+        print(f"Enrolled {args.name} from {len(audio) / SAMPLE_RATE:.1f}s of audio")
+    elif args.command == "remove":
+        index.remove(args.name)
+        index.save()
+    else:
+        names, counts = np.unique(index.names, return_counts=True)
+        for name, count in zip(names, counts):
+            print(f"{name} ({count} enrollment{'s' if count > 1 else ''})")
@@ -0,0 +1,104 @@
+import queue
+import threading
+import time
+
+_DONE = object()  # Sentinel passed down the queues once every job has been fed in
+
+
+class StageQueue:
+    """
+    A bounded queue between two pipeline stages that records how full it gets.
+    A full queue blocks the upstream stage (backpressure), which keeps memory bounded.
+    """
+
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.depth_samples = []
+        self.put_wait = 0.0  # Seconds the producer spent blocked on a full queue
+        self.get_wait = 0.0  # Seconds the consumer spent waiting on an empty queue
+
+    def put(self, item):
+        wait_start = time.time()
+        self.queue.put(item)
+        self.put_wait += time.time() - wait_start
+        self.depth_samples.append(self.queue.qsize())
+
+    def get(self):
+        wait_start = time.time()
+        item = self.queue.get()
+        self.get_wait += time.time() - wait_start
+        return item
+
+    def metrics(self):
+        samples = self.depth_samples or [0]
+        return {
+            "queue": self.name,
+            "max_depth": max(samples),
+            "mean_depth": sum(samples) / len(samples),
+            "producer_blocked_seconds": self.put_wait,
+            "consumer_waiting_seconds": self.get_wait,
+        }
+
+
+def _run_stage(stage_name, stage_function, input_queue, output_queue, stage_times):
+    while True:
+        job = input_queue.get()
+        if job is _DONE:
+            break
+        if "error" not in job:  # A job that failed upstream is passed along untouched
+            stage_start = time.time()
+            try:
+                stage_function(job)
+            except Exception as error:
+                job["error"] = f"{stage_name}: {error!r}"
+                print(f"Failed {job.get('file_path')} in stage {job['error']}")
+            stage_times[stage_name] += time.time() - stage_start
+        output_queue.put(job)
+    output_queue.put(_DONE)
+
+
+def run_pipelined(jobs, stages, queue_size=1):
+    """
+    Run every job through the list of (name, function) stages with each stage in its own thread,
+    so that stage k works on job n while stage k+1 works on job n-1.
+    Returns the finished jobs in order of completion, the per-queue metrics and the busy time per stage.
+    """
+    queues = [StageQueue("input", queue_size)]
+    queues += [StageQueue(f"after {name}", queue_size) for name, _ in stages]
+    stage_times = {name: 0.0 for name, _ in stages}
+
+    threads = []
+    for stage_index, (name, function) in enumerate(stages):
+        thread = threading.Thread(
+            target=_run_stage,
+            args=(name, function, queues[stage_index], queues[stage_index + 1]),
+            kwargs={"stage_times": stage_times},
+            name=f"stage-{name}",
+            daemon=True,
+        )
+        thread.start()
+        threads.append(thread)
+
+    # Drain the last queue in its own thread so that feeding jobs in never deadlocks
+    finished_jobs = []
+
+    def _collect():
+        while True:
+            job = queues[-1].get()
+            if job is _DONE:
+                break
+            finished_jobs.append(job)
+
+    collector = threading.Thread(target=_collect, name="stage-collect", daemon=True)
+    collector.start()
+
+    for job in jobs:
+        queues[0].put(job)
+    queues[0].put(_DONE)
+
+    for thread in threads:
+        thread.join()
+    collector.join()
+
+    return finished_jobs, [stage_queue.metrics() for stage_queue in queues], stage_times
@@ -1,69 +1,299 @@
+import asyncio
+import json
 import openai
 import config
+from completion_cache import CompletionCache
+from request_scheduler import RequestScheduler
+import metrics
 
 openai.api_key = config.authorization
+openai.max_retries = 0  # Retries are left to the request scheduler
+
+DEFAULT_MODEL = "gpt-4o"  # gpt-3.5-turbo, gpt-4-1106-preview
+# Bump whenever a prompt or the batching changes so cached results are redone
+PROMPT_VERSION = 2
+MAX_CHUNK_TOKENS = 64000  # Tokens per request, well inside the model's context window
+
+# Completions are only cached once a cache is configured, and only at temperature 0 where the
+# same request should give the same answer. Set use_completion_cache to False to bypass it.
+completion_cache = None
+use_completion_cache = True
+
+
+# Every request goes through one scheduler, which paces requests to the rate limits and retries
+# rate limit and server errors with backoff until its retry budget runs out
+REPLY_TOKEN_ESTIMATE = (
+    1000  # Added to the prompt's tokens when reserving tokens per minute
+)
+scheduler = RequestScheduler()
+
+
+def configure_scheduler(**settings):
+    global scheduler
+    scheduler = RequestScheduler(**settings)
+    return scheduler
+
+
+def _estimated_tokens(prompt):
+    return default_token_counter()(prompt) + REPLY_TOKEN_ESTIMATE
+
+
+def configure_completion_cache(path, max_bytes):
+    global completion_cache
+    completion_cache = CompletionCache(path, max_bytes)
+    return completion_cache
+
+
+def _cache_key(messages, model, temperature, response_format):
+    if completion_cache is None or not use_completion_cache or temperature != 0:
+        return None
+    if response_format is openai.NOT_GIVEN:
+        response_format = None
+    return completion_cache.key(
+        model, messages, temperature=temperature, response_format=response_format
+    )
+
+
+def _count_usage(response):
+    metrics.count("llm_requests")
+    if response.usage is not None:
+        metrics.count("llm_prompt_tokens", response.usage.prompt_tokens)
+        metrics.count("llm_completion_tokens", response.usage.completion_tokens)
 
 
 # Completion
 def get_completion(
-    prompt, model="gpt-4o", temperature=0
-):  # gpt-3.5-turbo, gpt-4-1106-preview
+    prompt, model=DEFAULT_MODEL, temperature=0, response_format=openai.NOT_GIVEN
+):
     messages = [{"role": "user", "content": prompt}]
-    response = openai.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=temperature,  # this is the degree of randomness of the model's output
+    cache_key = _cache_key(messages, model, temperature, response_format)
+    if cache_key is not None:
+        cached_response = completion_cache.get(cache_key)
+        if cached_response is not None:
+            metrics.count("llm_cache_hits")
+            return cached_response
+
+    response = scheduler.call(
+        lambda: openai.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,  # this is the degree of randomness of the model's output
+            response_format=response_format,
+        ),
+        _estimated_tokens(prompt),
     )
-    return response.choices[0].message.content
+    _count_usage(response)
+    content = response.choices[0].message.content
+    if cache_key is not None:
+        completion_cache.put(cache_key, content)
+    return content
+
+
+# Asynchronous completion, for sending several requests at once
+async def get_completion_async(
+    client, prompt, model=DEFAULT_MODEL, temperature=0, response_format=openai.NOT_GIVEN
+):
+    messages = [{"role": "user", "content": prompt}]
+    cache_key = _cache_key(messages, model, temperature, response_format)
+    if cache_key is not None:
+        cached_response = completion_cache.get(cache_key)
+        if cached_response is not None:
+            metrics.count("llm_cache_hits")
+            return cached_response
+
+    response = await scheduler.call_async(
+        lambda: client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            response_format=response_format,
+        ),
+        _estimated_tokens(prompt),
+    )
+    _count_usage(response)
+    content = response.choices[0].message.content
+    if cache_key is not None:
+        completion_cache.put(cache_key, content)
+    return content
 
 
 # Prompt summarise
-def prompt_and_complete_summarise(summary_length, text_to_summarise):
-    prompt = f"""
+def prompt_summarise(summary_length, text_to_summarise):
+    return f"""
     Your task is to generate a short summary of the text below (delimited by triple backticks) in at most {summary_length} words. 
 
     The text: ```{text_to_summarise}```
     """
 
-    return get_completion(prompt)
+
+def prompt_and_complete_summarise(summary_length, text_to_summarise):
+    return get_completion(prompt_summarise(summary_length, text_to_summarise))
+
+
+# Token counting
+def count_words(text):
+    return len(text.split())
+
+
+_token_counter = None
+
+
+def default_token_counter():
+    """
+    Count tokens with the model's own tokenizer when tiktoken is installed, otherwise count words.
+    """
+    global _token_counter
+    if _token_counter is None:
+        try:
+            import tiktoken
+
+            encoding = tiktoken.encoding_for_model(DEFAULT_MODEL)
+
+            def count_model_tokens(text):
+                return len(encoding.encode(text, disallowed_special=()))
+
+            _token_counter = count_model_tokens
+        except (
+            ImportError,
+            KeyError,
+            OSError,
+        ):  # Not installed, unknown model or offline
+            _token_counter = count_words
+    return _token_counter
 
 
-# Batch a string into a correctly sized list of words
-def batch_list(text, max_batch_size):
-    word_list = text.split()
-    word_batches = []
-    word_batch = ""
-    for word in word_list:
-        if len((word_batch + word).split()) <= max_batch_size:
-            word_batch += word + " "
+# Batch a string into correctly sized chunks
+def chunk_text(text, max_tokens, count_tokens=None, overlap=0, separator="\n\n"):
+    """
+    Split text into chunks of at most max_tokens in a single pass, counting each piece of text once.
+    Chunks break between speaker turns (paragraphs separated by a blank line) where possible and
+    between words inside turns that are too long on their own. Every chunk after the first starts
+    with up to `overlap` tokens from the end of the previous chunk.
+    """
+    if overlap >= max_tokens:
+        raise ValueError("The overlap must be smaller than the maximum chunk size")
+    count_tokens = count_tokens or default_token_counter()
+    piece_limit = (
+        max_tokens - overlap
+    )  # Leaves room for the overlap in front of any piece
+
+    # Pieces are (text, tokens, turn number), so pieces of one turn are joined back with a space
+    def split_into_words(turn, turn_number, limit):
+        pieces = []
+        piece_words = []
+        piece_tokens = 0
+        for word in turn.split():
+            word_tokens = count_tokens(word)
+            if piece_words and piece_tokens + word_tokens > limit:
+                pieces.append((" ".join(piece_words), piece_tokens, turn_number))
+                piece_words = []
+                piece_tokens = 0
+            piece_words.append(word)
+            piece_tokens += word_tokens
+        if piece_words:
+            pieces.append((" ".join(piece_words), piece_tokens, turn_number))
+        return pieces
+
+    def join_pieces(pieces):
+        joined = []
+        previous_turn = None
+        for piece, _, turn_number in pieces:
+            if joined:
+                joined.append(" " if turn_number == previous_turn else separator)
+            joined.append(piece)
+            previous_turn = turn_number
+        return "".join(joined)
+
+    def overlap_tail(pieces):
+        tail = []
+        tail_tokens = 0
+        for piece, piece_tokens, turn_number in reversed(pieces):
+            if tail_tokens + piece_tokens <= overlap:
+                tail.insert(0, (piece, piece_tokens, turn_number))
+                tail_tokens += piece_tokens
+                continue
+            # Finish with the last words of the piece that does not fit whole
+            tail_words = []
+            for word in reversed(piece.split()):
+                word_tokens = count_tokens(word)
+                if tail_tokens + word_tokens > overlap:
+                    break
+                tail_words.insert(0, word)
+                tail_tokens += word_tokens
+            if tail_words:
+                tail.insert(0, (" ".join(tail_words), tail_tokens, turn_number))
+            break
+        return tail, tail_tokens
+
+    chunks = []
+    current_pieces = []
+    current_tokens = 0
+    new_tokens = 0  # Tokens in the current chunk that are not overlap
+    for turn_number, turn in enumerate(text.split(separator)):
+        turn = turn.strip()
+        if not turn:
+            continue
+        turn_tokens = count_tokens(turn)
+        if turn_tokens > piece_limit:
+            pieces = split_into_words(turn, turn_number, piece_limit)
         else:
-            word_batches.append(word_batch)
-            word_batch = word + " "
-    word_batches.append(word_batch)
+            pieces = [(turn, turn_tokens, turn_number)]
+
+        for piece, piece_tokens, _ in pieces:
+            if new_tokens and current_tokens + piece_tokens > max_tokens:
+                chunks.append(join_pieces(current_pieces))
+                current_pieces, current_tokens = overlap_tail(current_pieces)
+                new_tokens = 0
+            current_pieces.append((piece, piece_tokens, turn_number))
+            current_tokens += piece_tokens
+            new_tokens += piece_tokens
+    if new_tokens:
+        chunks.append(join_pieces(current_pieces))
+
+    return chunks
 
-    return word_batches
 
+async def concurrent_completions(
+    prompts, concurrency, response_format=openai.NOT_GIVEN
+):
+    """
+    Complete all the prompts with at most `concurrency` requests in flight. The responses are
+    returned in the order of the prompts.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def complete(client, prompt):
+        async with semaphore:
+            return await get_completion_async(
+                client, prompt, response_format=response_format
+            )
+
+    # A client per event loop, since its connections are tied to the loop that opened them
+    async with openai.AsyncOpenAI(
+        api_key=config.authorization, max_retries=0
+    ) as client:
+        return await asyncio.gather(*(complete(client, prompt) for prompt in prompts))
 
-def batch_summariser(text, batch_summary_length, max_batch_size):
-    word_batches = batch_list(text, max_batch_size)
+
+def batch_summariser(text, batch_summary_length, max_batch_size, concurrency=1):
+    word_batches = chunk_text(text, max_batch_size)
+    with metrics.span("summary_pass", chunks=len(word_batches)):
+        return _summarise_batches(word_batches, batch_summary_length, concurrency)
+
+
+def _summarise_batches(word_batches, batch_summary_length, concurrency):
+    if concurrency > 1 and len(word_batches) > 1:
+        prompts = [
+            prompt_summarise(batch_summary_length, word_batch)
+            for word_batch in word_batches
+        ]
+        return " ".join(asyncio.run(concurrent_completions(prompts, concurrency)))
 
     # Loop through the list of batches and summarise each of them
     batch_summaries = []
     for word_batch in word_batches:
-        success = False
-        timeout_counter = 0
-        while not success:
-            if timeout_counter < 10:
-                try:
-                    response = prompt_and_complete_summarise(
-                        batch_summary_length, word_batch
-                    )
-                    batch_summaries.append(response)
-                    success = True
-                except:
-                    pass
-            else:
-                break
+        response = prompt_and_complete_summarise(batch_summary_length, word_batch)
+        batch_summaries.append(response)
 
     # Create a single string of all the summaries
     batch_summary = " ".join(batch_summaries)
@@ -71,13 +301,14 @@ def batch_summariser(text, batch_summary_length, max_batch_size):
     return batch_summary
 
 
-def summarise(text_to_summarise, summary_length):
+def summarise_text(text_to_summarise, summary_length, concurrency=1):
     # Settings
-    max_batch_size = 64000  # Number of words that are equivalent to the max number of tokens CHAT-GPT allows
+    max_batch_size = MAX_CHUNK_TOKENS
     small_batch_initial_summary_length = 30  # Summary length produced for each batch
+    count_tokens = default_token_counter()
 
-    # Read the text and split it into a list of words
-    text = str(text_to_summarise.replace("\n", ""))
+    # Speaker turns are kept apart so chunks can break between them
+    text = str(text_to_summarise).strip()
 
     batch_summary = text  # The summarised version is intially the whole text until we measure its length and discover it is too long
     intermediate_passes = 0
@@ -87,13 +318,14 @@ def summarise(text_to_summarise, summary_length):
                 f"In large loop {i} the number of words in the batch summary is {len(batch_summary.split())}"
             )
 
-        current_batch_size = len(
-            " ".join(batch_list(batch_summary, max_batch_size)).split()
-        )
+        current_batch_size = count_tokens(batch_summary)
 
         if current_batch_size > max_batch_size:
             batch_summary = batch_summariser(
-                batch_summary, small_batch_initial_summary_length * i, max_batch_size
+                batch_summary,
+                small_batch_initial_summary_length * i,
+                max_batch_size,
+                concurrency,
             )  # Make the summary length longer when there are fewer of them to go on
             intermediate_passes += 1
             print(
@@ -102,7 +334,7 @@ def summarise(text_to_summarise, summary_length):
 
         else:  # Final summarisation and file output
             batch_summary = batch_summariser(
-                batch_summary, summary_length, max_batch_size
+                batch_summary, summary_length, max_batch_size, concurrency
             )
             print(
                 f"The number of intermediate summarisation passes was: {intermediate_passes}"
@@ -125,39 +357,119 @@ def prompt_and_complete_actions(text_to_find_actions):
     return get_completion(prompt)
 
 
-def find_actions(text_to_find_actions):
-    # Settings
-    max_batch_size = 64000  # Number of words that are equivalent to the max number of tokens CHAT-GPT allows
-
-    # Read the text and split it into a list of words
-    text = str(text_to_find_actions.replace("\n", ""))
-    text_word_lst = text.split()
-
-    text_groups = []
-    if len(text_word_lst) < max_batch_size:
-        text_groups.append(" ".join(text_word_lst))
-    else:
-        while len(text_word_lst) > max_batch_size:
-            text_groups.append(" ".join(text_word_lst[:max_batch_size]))
-            text_word_lst = text_word_lst[max_batch_size:]
+def find_actions_text(text_to_find_actions):
+    # Split the transcript into chunks that fit in one request, between speaker turns
+    text_groups = chunk_text(str(text_to_find_actions), MAX_CHUNK_TOKENS)
 
     actions_strings = []
-    for text_group in text_groups:
-        success = False
-        timeout_counter = 0
-        while not success:
-            if timeout_counter < 10:
-                try:
-                    response = prompt_and_complete_actions(text_group)
-                    print(response)
-                    actions_strings.append(response)
-                    success = True
-                except:
-                    pass
-            else:
-                break
+    with metrics.span("actions", chunks=len(text_groups)):
+        for text_group in text_groups:
+            response = prompt_and_complete_actions(text_group)
+            print(response)
+            actions_strings.append(response)
 
     # Create a single string of all the summaries
     actions = "\n".join(actions_strings)
 
     return actions
+
+
+# Prompt summary and actions together
+def prompt_summarise_and_find_actions(summary_length, text_to_summarise):
+    return f"""
+    Your task is to read the meeting transcript below (delimited by triple backticks) and reply with a JSON object with two keys.
+    "summary": a short summary of the text in at most {summary_length} words.
+    "actions": a list of strings, one for anything that looks like a meeting action, each summarising the action along with which person is doing it and by when if this information is available. Use an empty list if there are no actions.
+
+    The text: ```{text_to_summarise}```
+    """
+
+
+def parse_summary_and_actions(response):
+    """
+    Return (summary, list of actions) from a JSON reply, or None if the reply is not usable.
+    """
+    try:
+        reply = json.loads(response)
+        summary = str(reply["summary"])
+        actions = reply.get("actions", [])
+        if isinstance(actions, str):  # A single action given as a string, not a list
+            actions = [actions]
+        actions = [str(action) for action in actions]
+    except (TypeError, ValueError, KeyError, AttributeError):
+        return None
+    return summary, actions
+
+
+def summarise_and_find_actions(
+    text, summary_length, concurrency=1, include_summary=True, include_actions=True
+):
+    """
+    Summarise a transcript and find its meeting actions. With both requested, each chunk is sent
+    once and the model replies with both in one JSON object; the chunk summaries are then reduced
+    like any other summaries and the actions are merged. Returns (summary, actions).
+    """
+    if not include_actions:
+        return summarise_text(text, summary_length, concurrency), None
+    if not include_summary:
+        return None, find_actions_text(text)
+
+    chunks = chunk_text(str(text), MAX_CHUNK_TOKENS)
+    if not chunks:
+        return "", "- There are no actions from this meeting."
+
+    # A single chunk gets the final summary length straight away
+    small_batch_initial_summary_length = 30  # Summary length produced for each batch
+    chunk_summary_length = (
+        summary_length if len(chunks) == 1 else small_batch_initial_summary_length
+    )
+    prompts = [
+        prompt_summarise_and_find_actions(chunk_summary_length, chunk)
+        for chunk in chunks
+    ]
+    with metrics.span("summary_and_actions", chunks=len(chunks)):
+        responses = asyncio.run(
+            concurrent_completions(
+                prompts, concurrency, response_format={"type": "json_object"}
+            )
+        )
+
+    chunk_summaries = []
+    action_lines = []
+    for chunk, response in zip(chunks, responses):
+        reply = parse_summary_and_actions(response)
+        if reply is None:
+            # No usable JSON, so ask for this chunk's two parts separately
+            chunk_summaries.append(
+                batch_summariser(chunk, chunk_summary_length, MAX_CHUNK_TOKENS)
+            )
+            action_lines.append(find_actions_text(chunk))
+            continue
+        chunk_summary, chunk_actions = reply
+        chunk_summaries.append(chunk_summary)
+        action_lines += [
+            f"- {action}"
+            for action in chunk_actions
+            if f"- {action}" not in action_lines
+        ]
+
+    # Reduce
+    if len(chunks) == 1:
+        summary = chunk_summaries[0]
+    else:
+        summary = summarise_text(" ".join(chunk_summaries), summary_length, concurrency)
+    actions = "\n".join(action_lines) or "- There are no actions from this meeting."
+
+    return summary, actions
+
+
+def summarise(text_to_summarise, summary_length, concurrency=1):
+    return summarise_and_find_actions(
+        text_to_summarise, summary_length, concurrency, include_actions=False
+    )[0]
+
+
+def find_actions(text_to_find_actions):
+    return summarise_and_find_actions(
+        text_to_find_actions, None, include_summary=False
+    )[1]
@@ -0,0 +1,23 @@
+from checkpoint import Checkpoint
+
+
+def test_groups_appended_after_a_torn_line_are_kept(tmp_path):
+    checkpoint = Checkpoint(tmp_path, "meeting")
+    checkpoint.append_group(0, "Hello.")
+    checkpoint.append_group(1, "Hi.")
+    # A crash part way through writing group 2
+    with open(checkpoint.groups_path, "a") as file:
+        file.write('{"group": 2, "transcr')
+
+    assert checkpoint.load_groups() == {0: "Hello.", 1: "Hi."}
+
+    # The resumed run transcribes the rest, then crashes again before finishing
+    checkpoint.append_group(2, "How are you?")
+    checkpoint.append_group(3, "Fine.")
+
+    assert checkpoint.load_groups() == {
+        0: "Hello.",
+        1: "Hi.",
+        2: "How are you?",
+        3: "Fine.",
+    }
@@ -0,0 +1,17 @@
+import pickle
+from metrics import FileMetrics
+
+
+def test_file_metrics_pickle_for_workers():
+    # Every job carries its FileMetrics, and run_workers sends jobs to the pool, which pickles them
+    file_metrics = FileMetrics("meeting.mp4")
+    with file_metrics.span("decode", stage=True):
+        file_metrics.count("audio_seconds", 60)
+
+    restored = pickle.loads(pickle.dumps(file_metrics))
+
+    assert restored.file_path == "meeting.mp4"
+    assert restored.counters == {"audio_seconds": 60}
+    with restored.span("diarize", stage=True):
+        pass
+    assert [span["name"] for span in restored.spans] == ["decode", "diarize"]
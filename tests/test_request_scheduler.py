@@ -0,0 +1,84 @@
+import time
+import openai
+import pytest
+from openai_stub import start_stub_server
+from request_scheduler import RequestScheduler, RetryBudgetExceeded
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**settings):
+        server = start_stub_server(**settings)
+        servers.append(server)
+        client = openai.OpenAI(
+            base_url=f"http://127.0.0.1:{server.server_address[1]}/v1/",
+            api_key="stub",
+            max_retries=0,  # Retries are left to the scheduler, as in summarise.py
+        )
+        return server, client
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def complete(client):
+    return lambda: client.chat.completions.create(
+        model="stub", messages=[{"role": "user", "content": "Hello"}]
+    )
+
+
+@pytest.mark.parametrize("fail_status", [429, 500])
+def test_retries_honour_retry_after(stub, fail_status):
+    server, client = stub(fail_rate=1.0, fail_status=fail_status, retry_after=0.2)
+    scheduler = RequestScheduler(max_attempts=3, base_delay=0.001)
+
+    start = time.monotonic()
+    with pytest.raises(RetryBudgetExceeded):
+        scheduler.call(complete(client))
+
+    assert server.RequestHandlerClass.requests_received == 3
+    # Two retries, each waiting at least the 0.2s asked for rather than the tiny backoff
+    assert time.monotonic() - start >= 0.4
+
+
+def test_retry_budget_is_shared_until_reset(stub):
+    server, client = stub(fail_rate=1.0, fail_status=500)
+    scheduler = RequestScheduler(retry_budget=2, base_delay=0.001)
+
+    with pytest.raises(RetryBudgetExceeded):
+        scheduler.call(complete(client))
+    assert server.RequestHandlerClass.requests_received == 3
+
+    # The budget is spent, so the next request is not retried at all
+    with pytest.raises(RetryBudgetExceeded):
+        scheduler.call(complete(client))
+    assert server.RequestHandlerClass.requests_received == 4
+
+    scheduler.reset_retries()
+    with pytest.raises(RetryBudgetExceeded):
+        scheduler.call(complete(client))
+    assert server.RequestHandlerClass.requests_received == 7
+
+
+def test_bad_request_is_not_retried(stub):
+    server, client = stub(fail_rate=1.0, fail_status=400)
+    scheduler = RequestScheduler(base_delay=0.001)
+
+    with pytest.raises(openai.BadRequestError):
+        scheduler.call(complete(client))
+
+    assert server.RequestHandlerClass.requests_received == 1
+    assert scheduler.retries == 0
+
+
+def test_completion_is_returned(stub):
+    server, client = stub()
+    scheduler = RequestScheduler(base_delay=0.001)
+
+    response = scheduler.call(complete(client))
+
+    assert response.choices[0].message.content == "Stub completion of a 1 word prompt."
+    assert scheduler.retries == 0
@@ -0,0 +1,52 @@
+import json
+from transcript_writer import TranscriptWriter, read_sidecar, write_sidecar
+
+GROUPS = [
+    {"speaker": "Speaker 1", "start": 0.0, "end": 20.0},
+    {"speaker": "Speaker 2", "start": 20.0, "end": 83.5},
+]
+
+
+def test_groups_are_written_in_order(tmp_path):
+    text_path = tmp_path.joinpath("meeting.txt")
+    jsonl_path = tmp_path.joinpath("meeting.jsonl")
+    with TranscriptWriter(text_path, jsonl_path, GROUPS) as writer:
+        writer.add(1, "Hi.")
+        assert text_path.read_text() == ""  # Waits for group 0
+        writer.add(0, "Hello.")
+        writer.add_all(["Hello.", "Hi."])  # Already written, so ignored
+
+    assert (
+        text_path.read_text()
+        == "Speaker 1 [0:00:00]\nHello.\n\nSpeaker 2 [0:00:20]\nHi."
+    )
+    assert [record["transcription"] for record in read_sidecar(jsonl_path)] == [
+        "Hello.",
+        "Hi.",
+    ]
+
+
+def test_no_newline_after_an_empty_last_group(tmp_path):
+    text_path = tmp_path.joinpath("meeting.txt")
+    with TranscriptWriter(
+        text_path, tmp_path.joinpath("meeting.jsonl"), GROUPS
+    ) as writer:
+        writer.add_all(["Hello.", ""])
+
+    assert text_path.read_text() == "Speaker 1 [0:00:00]\nHello.\n\nSpeaker 2 [0:00:20]"
+
+
+def test_sidecar_round_trips(tmp_path):
+    records = [
+        {
+            "group": 0,
+            "speaker": "Speaker 1",
+            "start": 0.0,
+            "end": 20.0,
+            "transcription": "Hello.",
+        }
+    ]
+    write_sidecar(tmp_path.joinpath("copy.jsonl"), records)
+
+    assert read_sidecar(tmp_path.joinpath("copy.jsonl")) == records
+    assert json.loads(tmp_path.joinpath("copy.jsonl").read_text()) == records[0]
@@ -1,106 +1,639 @@
 import argparse
+import contextlib
+import multiprocessing
 import os
-from faster_whisper import WhisperModel
+from faster_whisper import WhisperModel, BatchedInferencePipeline
+from faster_whisper.utils import download_model
 from pathlib import Path
-import datetime
 from pyannote.audio import Pipeline  # For speaker diarization
-from pydub import AudioSegment
-from io import BytesIO
+import numpy as np
 import warnings
 import summarise
 import time
 import config
 import ffmpeg  # For in-memory audio extraction
 import torch
+import staged_pipeline
+import result_cache
+from checkpoint import Checkpoint
+from audio_stream import StreamingDecoder
+import vad
+import windowed_diarization
+import speaker_index
+import metrics
+import profiling
+import machine_profile
+import transcript_writer
+import model_selection
+import service
 
-# Start timing
-start_time = time.time()
-
-# Argparse setup
-parser = argparse.ArgumentParser(
-    prog="Transcribe Video",
-    description="This program takes the path to a video file and transcribes it using Faster-Whisper with automatic speaker diarization using Pyannote.audio",
-)
-
-parser.add_argument(
-    "file_path",
-    nargs="+",
-    help="A full or relative path to a media file, several media files, or a directory of media files to transcribe",
-)
-args = parser.parse_args()
-
-# Parse arguments
-argparse_list_of_paths = []
-if args.file_path:
-    [
-        argparse_list_of_paths.append(individual_path)
-        for individual_path in args.file_path
-    ]
+SAMPLE_RATE = 16000  # Both Whisper and pyannote expect 16 kHz mono
+WHISPER_MODEL_SIZE = "small"
+SUMMARY_LENGTH = 300  # Maximum number of words in the summary
 
-full_file_path_list = []  # This is sent to the main transcribing function
-for individual_path in argparse_list_of_paths:
-    if os.path.isdir(individual_path):  # Directory
-        for dir_path, dir_names, file_names in os.walk(individual_path):
-            for file_name in file_names:
-                if not file_name.startswith("."):
-                    file_path_found = os.path.join(dir_path, file_name)
-                    full_file_path_list.append(file_path_found)
-    else:  # File
-        full_file_path_list.append(individual_path)
 
+def parse_arguments(argv=None):
+    # Argparse setup
+    parser = argparse.ArgumentParser(
+        prog="Transcribe Video",
+        description="This program takes the path to a video file and transcribes it using Faster-Whisper with automatic speaker diarization using Pyannote.audio",
+    )
 
-# Utility function to extract audio from video in memory using ffmpeg-python
-def extract_audio_from_video(video_path, target_sample_rate=16000):
+    parser.add_argument(
+        "file_path",
+        nargs="*",
+        help="A full or relative path to a media file, several media files, or a directory of media files to transcribe",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["groups", "batched", "words"],
+        default="groups",
+        help="How speaker groups are transcribed: one decode per group, many groups packed into batched inference calls, or the whole file once with words assigned to speaker turns",
+    )
+    parser.add_argument(
+        "--model",
+        choices=model_selection.MODEL_SIZES,
+        default=WHISPER_MODEL_SIZE,
+        help="Whisper model size to transcribe with when there is no --deadline or --target-rtf",
+    )
+    deadline_group = parser.add_mutually_exclusive_group()
+    deadline_group.add_argument(
+        "--deadline",
+        type=float,
+        help="Minutes after a file is submitted (or the run starts) by which its transcript must be ready. The most accurate model size expected to finish in time is used, and a smaller one for the rest of the file if transcription falls behind",
+    )
+    deadline_group.add_argument(
+        "--target-rtf",
+        type=float,
+        help="Like --deadline, with the deadline set to this many seconds of processing per second of the file's audio",
+    )
+    parser.add_argument(
+        "--draft-model",
+        choices=["tiny", "base"],
+        help="Transcribe in two passes (groups mode only): every group with this model and greedy decoding first, writing a draft transcript, then only the groups it was unsure of with the main model",
+    )
+    parser.add_argument(
+        "--logprob-threshold",
+        type=float,
+        default=-1.0,
+        help="A draft group is transcribed again if any of its segments has a lower average log probability",
+    )
+    parser.add_argument(
+        "--no-speech-threshold",
+        type=float,
+        default=0.6,
+        help="A draft group is transcribed again if any of its segments has a higher no-speech probability",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=8,
+        help="Number of audio clips per batched inference call (batched mode only)",
+    )
+    parser.add_argument(
+        "--compare-modes",
+        action="store_true",
+        help="Also run the per-group loop on each file and report the speedup of the selected mode over it",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Overlap the stages of consecutive files: decode file N+1 while diarizing N, transcribing N-1 and summarising N-2",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=1,
+        help="Maximum number of files waiting between two pipeline stages (bounds memory in --pipeline mode)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes forked after the diarization model is loaded, each with its own share of the CPU threads",
+    )
+    parser.add_argument(
+        "--llm-concurrency",
+        type=int,
+        default=4,
+        help="Maximum number of summary requests sent to the LLM at the same time",
+    )
+    parser.add_argument(
+        "--llm-rpm",
+        type=int,
+        default=500,
+        help="Maximum LLM requests per minute (0 for no limit)",
+    )
+    parser.add_argument(
+        "--llm-tpm",
+        type=int,
+        default=0,
+        help="Maximum LLM tokens per minute, prompt plus an estimate of the reply (0 for no limit)",
+    )
+    parser.add_argument(
+        "--llm-retry-budget",
+        type=int,
+        default=100,
+        help="Total number of LLM request retries allowed in the run (per file with --serve) before giving up",
+    )
+    parser.add_argument(
+        "--combined-summary",
+        action="store_true",
+        help="Ask for the summary and the meeting actions in one structured request per chunk instead of two passes",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=result_cache.DEFAULT_CACHE_DIR,
+        help="Directory for cached results of files that were already processed with the same settings",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=1024,
+        help="Maximum size of the result cache in MB; the least recently used results are evicted first",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Process every file even if an identical one was already processed with the same settings",
+    )
+    parser.add_argument(
+        "--llm-cache-size",
+        type=int,
+        default=256,
+        help="Maximum size of the on-disk cache of LLM completions in MB",
+    )
+    parser.add_argument(
+        "--no-llm-cache",
+        action="store_true",
+        help="Always send summary and action requests to the LLM instead of reusing cached completions",
+    )
+    parser.add_argument(
+        "--stream-decode",
+        action="store_true",
+        help="Decode in fixed-size chunks into a memory-mapped buffer on disk so memory use does not grow with file length",
+    )
+    parser.add_argument(
+        "--decode-chunk-seconds",
+        type=float,
+        default=10,
+        help="Seconds of audio read from ffmpeg per chunk with --stream-decode",
+    )
+    parser.add_argument(
+        "--vad",
+        choices=["off", "energy", "silero"],
+        default="off",
+        help="Remove non-speech before diarization and transcription with an energy detector or faster-whisper's Silero VAD; timestamps stay on the original clock",
+    )
+    parser.add_argument(
+        "--num-speakers",
+        type=int,
+        help="The exact number of speakers, if known, so diarization does not have to estimate it",
+    )
+    parser.add_argument(
+        "--min-speakers",
+        type=int,
+        help="The smallest number of speakers diarization should consider",
+    )
+    parser.add_argument(
+        "--max-speakers",
+        type=int,
+        help="The largest number of speakers diarization should consider",
+    )
+    parser.add_argument(
+        "--diarize-window",
+        type=float,
+        default=0,
+        help="Diarize recordings longer than this many minutes in overlapping windows and match speakers across them (0 diarizes the whole file at once)",
+    )
+    parser.add_argument(
+        "--diarize-overlap",
+        type=float,
+        default=60,
+        help="Seconds of overlap between consecutive diarization windows",
+    )
+    parser.add_argument(
+        "--diarize-workers",
+        type=int,
+        default=1,
+        help="Number of diarization windows processed at the same time",
+    )
+    parser.add_argument(
+        "--no-diarize",
+        action="store_true",
+        help="Skip speaker diarization for single-speaker recordings and split the transcript at pauses instead",
+    )
+    parser.add_argument(
+        "--identify-speakers",
+        action="store_true",
+        help="Name speakers who match a person enrolled in the speaker index instead of numbering them",
+    )
+    parser.add_argument(
+        "--speaker-index",
+        default=speaker_index.DEFAULT_INDEX_PATH,
+        help="Path of the speaker index built with speaker_index.py enroll",
+    )
+    parser.add_argument(
+        "--speaker-threshold",
+        type=float,
+        default=0.5,
+        help="Minimum cosine similarity between a speaker and an enrolled person for the person's name to be used",
+    )
+    parser.add_argument(
+        "--no-checkpoint",
+        action="store_true",
+        help="Do not keep per-stage checkpoints in the cache directory for resuming a file after a crash",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        help="JSON lines file that gets one record of timing spans and counters per processed file (defaults to metrics.jsonl in the cache directory)",
+    )
+    parser.add_argument(
+        "--prometheus-file",
+        help="Also write run totals in the Prometheus text format to this file (in --serve mode they are also served at /metrics)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile every stage with cProfile and tracemalloc (and pyinstrument if installed) and write the reports next to the transcript",
+    )
+    parser.add_argument(
+        "--no-machine-profile",
+        action="store_true",
+        help="Ignore the Whisper settings saved by tune.py and use the defaults",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Keep the models loaded and accept jobs over a local HTTP API instead of processing file_path",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8765,
+        help="Port on 127.0.0.1 for --serve",
+    )
+    parser.add_argument(
+        "--socket",
+        help="Serve on this Unix socket path instead of a TCP port with --serve",
+    )
+    args = parser.parse_args(argv)
+    if not args.file_path and not args.serve:
+        parser.error("the following arguments are required: file_path")
+    if args.diarize_window and not 0 <= args.diarize_overlap < args.diarize_window * 60:
+        parser.error(
+            "--diarize-overlap must be at least 0 and shorter than --diarize-window"
+        )
+    if args.draft_model is not None and args.mode != "groups":
+        parser.error("--draft-model needs --mode groups")
+    return args
+
+
+# Extensions of the files this tool writes next to the media: the transcript and its draft,
+# profile reports (.txt), the sidecar (.jsonl), profiler stats (.pstats) and the temporary file of
+# the summary rewrite (.tmp). They are skipped in a directory, so the next sweep does not take them
+# for media.
+OUTPUT_EXTENSIONS = {".txt", ".jsonl", ".pstats", ".tmp"}
+
+
+def collect_file_paths(paths):
+    full_file_path_list = []  # This is sent to the main transcribing function
+    for individual_path in paths:
+        if os.path.isdir(individual_path):  # Directory
+            for dir_path, dir_names, file_names in os.walk(individual_path):
+                for file_name in file_names:
+                    if (
+                        not file_name.startswith(".")
+                        and Path(file_name).suffix.lower() not in OUTPUT_EXTENSIONS
+                    ):
+                        file_path_found = os.path.join(dir_path, file_name)
+                        full_file_path_list.append(file_path_found)
+        else:  # File
+            full_file_path_list.append(individual_path)
+    return full_file_path_list
+
+
+# Utility function to extract audio from any media file in memory using ffmpeg-python
+def extract_audio_from_video(video_path, target_sample_rate=SAMPLE_RATE):
     """
-    Extract audio from a video file in memory and return it as a pydub AudioSegment.
+    Decode the audio track of a media file once and return it as a float32 mono NumPy array.
     """
     out, _ = (
         ffmpeg.input(video_path)
-        .output("pipe:1", format="wav", ac=1, ar=target_sample_rate)
+        .output(
+            "pipe:1", format="f32le", acodec="pcm_f32le", ac=1, ar=target_sample_rate
+        )
         .run(capture_stdout=True, capture_stderr=True)
     )
-    return AudioSegment.from_file(BytesIO(out), format="wav")
+    return np.frombuffer(out, dtype=np.float32)
+
 
+SAMPLES_PER_CLIP = 30 * SAMPLE_RATE  # Whisper's fixed 30 s input window
 
-# Diarization and transcription model initialization
-model = WhisperModel("small", device="cpu")  # Faster-Whisper does not support mps
 
-# Determine device for PyTorch (mps or cpu)
-device = (
-    torch.device("mps") if torch.backends.mps.is_available() else torch.device("cpu")
-)
+def transcribe_groups(
+    model,
+    audio,
+    grouped_segments,
+    completed_groups=None,
+    on_group_transcribed=None,
+    on_group_timed=None,
+):
+    """
+    Transcribe each speaker group with its own decode session and return one string per group.
+    Groups already in completed_groups (index: text) are reused, and on_group_transcribed(index, text)
+    is called as each remaining group finishes. on_group_timed(audio_seconds, seconds) is called
+    with the time each group took and may return another model for the remaining groups.
+    """
+    completed_groups = completed_groups or {}
+    transcriptions = []
+    for group_index, group in enumerate(grouped_segments):
+        if group_index in completed_groups:
+            transcriptions.append(completed_groups[group_index])
+            continue
 
-# Initialize Pyannote pipeline and set device
-pipeline = Pipeline.from_pretrained(
-    "pyannote/speaker-diarization", use_auth_token=config.hf_authorization
-)
-pipeline.to(device)  # Set the device for the pipeline
+        speaker_start_sample = int(group["start"] * SAMPLE_RATE)
+        speaker_end_sample = int(group["end"] * SAMPLE_RATE)
 
-for file_counter, file_path_item in enumerate(full_file_path_list):
-    # File paths
-    file_name = Path(file_path_item).stem
-    file_parent = Path(file_path_item).parents[0]
+        # Slice the speaker's audio straight out of the decoded buffer (a view, no copy)
+        audio_segment = audio[speaker_start_sample:speaker_end_sample]
 
-    # Check if the input is a video or audio file
-    if file_path_item.lower().endswith((".mp4", ".mkv", ".avi", ".mov")):
-        # Extract audio from video
-        print(f"Extracting audio from video: {file_path_item}...")
-        audio = extract_audio_from_video(file_path_item)
-    else:
-        # Load audio directly
-        audio = (
-            AudioSegment.from_file(file_path_item).set_frame_rate(16000).set_channels(1)
+        # Transcribe the in-memory audio segment
+        group_start_time = time.perf_counter()
+        with metrics.span(
+            "transcribe_group",
+            group=group_index,
+            audio_seconds=round(len(audio_segment) / SAMPLE_RATE, 3),
+        ), warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            segments, info = model.transcribe(audio_segment, beam_size=5, language="en")
+
+            # Combine transcribed text (the segments are decoded as they are read)
+            all_transcribed_lines = [segment.text.strip() for segment in segments]
+        transcriptions.append(" ".join(all_transcribed_lines).strip())
+        if on_group_transcribed is not None:
+            on_group_transcribed(group_index, transcriptions[-1])
+        if on_group_timed is not None:
+            model = (
+                on_group_timed(
+                    len(audio_segment) / SAMPLE_RATE,
+                    time.perf_counter() - group_start_time,
+                )
+                or model
+            )
+
+    return transcriptions
+
+
+def draft_groups(model, audio, grouped_segments, completed_groups):
+    """
+    Transcribe each group not in completed_groups with greedy decoding. Returns, for each group
+    transcribed (index: draft), its text with the lowest average log probability and the highest
+    no-speech probability of its segments.
+    """
+    drafts = {}
+    for group_index, group in enumerate(grouped_segments):
+        if group_index in completed_groups:
+            continue
+        audio_segment = audio[
+            int(group["start"] * SAMPLE_RATE) : int(group["end"] * SAMPLE_RATE)
+        ]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            segments, info = model.transcribe(audio_segment, beam_size=1, language="en")
+            segments = list(segments)
+        drafts[group_index] = {
+            "text": " ".join(segment.text.strip() for segment in segments).strip(),
+            "lowest_logprob": min(
+                (segment.avg_logprob for segment in segments), default=0.0
+            ),
+            "highest_no_speech_prob": max(
+                (segment.no_speech_prob for segment in segments), default=0.0
+            ),
+        }
+    return drafts
+
+
+def transcribe_groups_batched(batched_model, audio, grouped_segments, batch_size):
+    """
+    Transcribe all speaker groups through batched inference and return one string per group.
+    Groups longer than Whisper's window are split into several clips; clips never cross groups.
+    """
+    clip_timestamps = []
+    clip_group_index = []
+    for group_index, group in enumerate(grouped_segments):
+        group_start_sample = int(group["start"] * SAMPLE_RATE)
+        group_end_sample = int(group["end"] * SAMPLE_RATE)
+        for clip_start in range(group_start_sample, group_end_sample, SAMPLES_PER_CLIP):
+            clip_end = min(clip_start + SAMPLES_PER_CLIP, group_end_sample)
+            clip_timestamps.append({"start": clip_start, "end": clip_end})
+            clip_group_index.append(group_index)
+
+    group_lines = [[] for _ in grouped_segments]
+    if not clip_timestamps:
+        return ["" for _ in grouped_segments]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        segments, info = batched_model.transcribe(
+            audio,
+            beam_size=5,
+            language="en",
+            batch_size=batch_size,
+            clip_timestamps=clip_timestamps,
         )
 
-    # Convert the in-memory `pydub.AudioSegment` into a BytesIO file-like object
-    audio_buffer = BytesIO()
-    audio.export(audio_buffer, format="wav")
-    audio_buffer.seek(0)
+    # Map each returned segment back to the clip (and so the group) it was decoded from
+    clip_start_times = np.array([clip["start"] for clip in clip_timestamps])
+    clip_start_times = clip_start_times / SAMPLE_RATE
+    clip_group_index = np.array(clip_group_index)
+    for segment in segments:
+        midpoint = (segment.start + segment.end) / 2
+        clip_index = max(
+            np.searchsorted(clip_start_times, midpoint, side="right") - 1, 0
+        )
+        group_lines[clip_group_index[clip_index]].append(segment.text.strip())
 
-    # Speaker diarization using pyannote.audio
-    print(f"Diarizing file {file_counter+1} of {len(full_file_path_list)}...")
-    diarization = pipeline({"uri": file_name, "audio": audio_buffer})
+    return [" ".join(lines).strip() for lines in group_lines]
+
+
+def assign_words_to_turns(
+    word_starts, word_ends, turn_starts, turn_ends, max_pairs=1 << 22
+):
+    """
+    Vectorized interval join: return, for each word, the index of the diarization turn it overlaps most.
+    Turns must be sorted by start. Every turn that can overlap a word is considered, however many
+    shorter turns start inside a long one, and ties go to the turn that started last. Words falling in
+    a gap go to the nearest turn. Words are joined in blocks of at most `max_pairs` candidate pairs.
+    """
+    turn_starts = np.asarray(turn_starts, dtype=np.float64)
+    turn_ends = np.asarray(turn_ends, dtype=np.float64)
+    word_starts = np.asarray(word_starts, dtype=np.float64)
+    word_ends = np.asarray(word_ends, dtype=np.float64)
 
+    # Candidates run from the first turn that some earlier-starting turn has not ended before the
+    # word starts (by the running maximum of the ends) to the last turn starting before it ends
+    running_ends = np.maximum.accumulate(turn_ends)
+    first_turn = np.searchsorted(running_ends, word_starts, side="right")
+    last_turn = np.searchsorted(turn_starts, word_ends, side="left") - 1
+    counts = np.maximum(last_turn - first_turn + 1, 0)
+
+    word_turns = np.clip(last_turn, 0, len(turn_starts) - 1)
+    best_overlap = np.full(len(word_starts), -np.inf)
+    block_start = 0
+    pair_totals = np.cumsum(counts)
+    while block_start < len(word_starts):
+        block_end = max(
+            block_start + 1,
+            np.searchsorted(
+                pair_totals,
+                pair_totals[block_start] - counts[block_start] + max_pairs,
+                side="right",
+            ),
+        )
+        block_counts = counts[block_start:block_end]
+        word_index = np.repeat(np.arange(block_start, block_end), block_counts)
+        if len(word_index):
+            offsets = np.cumsum(block_counts) - block_counts
+            turn_index = first_turn[word_index] + (
+                np.arange(len(word_index)) - offsets[word_index - block_start]
+            )
+            overlap = np.minimum(
+                word_ends[word_index], turn_ends[turn_index]
+            ) - np.maximum(word_starts[word_index], turn_starts[turn_index])
+            # The last pair of each word with its largest overlap, so ties go to the later turn
+            order = np.lexsort((turn_index, overlap, word_index))
+            last_of_word = np.r_[word_index[order][1:] != word_index[order][:-1], True]
+            best_pairs = order[last_of_word]
+            word_turns[word_index[best_pairs]] = turn_index[best_pairs]
+            best_overlap[word_index[best_pairs]] = overlap[best_pairs]
+        block_start = block_end
+
+    # Words in a silence between turns go to whichever neighbouring turn is closer
+    in_gap = best_overlap <= 0
+    if np.any(in_gap):
+        midpoints = (word_starts[in_gap] + word_ends[in_gap]) / 2
+        previous_turn = np.clip(last_turn[in_gap], 0, len(turn_starts) - 1)
+        next_turn = np.clip(last_turn[in_gap] + 1, 0, len(turn_starts) - 1)
+        previous_distance = np.abs(midpoints - turn_ends[previous_turn])
+        next_distance = np.abs(turn_starts[next_turn] - midpoints)
+        word_turns[in_gap] = np.where(
+            next_distance < previous_distance, next_turn, previous_turn
+        )
+
+    return word_turns
+
+
+def transcribe_words(model, audio, master_dictionary, grouped_segments):
+    """
+    Transcribe the whole file once with word timestamps, assign every word to a diarization turn and
+    return one string per speaker group, matching the text the per-group loop produces.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        segments, info = model.transcribe(
+            audio, beam_size=5, language="en", word_timestamps=True
+        )
+        words = [word for segment in segments for word in segment.words]
+
+    group_words = [[] for _ in grouped_segments]
+    if words and master_dictionary:
+        word_turns = assign_words_to_turns(
+            [word.start for word in words],
+            [word.end for word in words],
+            [turn["start"] for turn in master_dictionary],
+            [turn["end"] for turn in master_dictionary],
+        )
+        for word, turn_index in zip(words, word_turns):
+            group_index = master_dictionary[turn_index]["group"]
+            group_words[group_index].append(word.word.strip())
+
+    return [" ".join(words).strip() for words in group_words]
+
+
+def load_whisper(models, model_size, cpu_threads=None):
+    """
+    Load the Faster-Whisper model of model_size into the models dictionary with the machine
+    profile's compute type and thread count for that size, if there is one. cpu_threads, once given,
+    overrides the profile's for every size loaded afterwards (0 lets either decide).
+    """
+    if cpu_threads is not None:
+        models["cpu_threads"] = cpu_threads
+    whisper_paths = models.setdefault("whisper_paths", {})
+    if model_size not in whisper_paths:
+        whisper_paths[model_size] = download_model(model_size)
+    settings = models.get("whisper_settings", {}).get(model_size, {})
+    model = WhisperModel(
+        whisper_paths[model_size],
+        device="cpu",  # Faster-Whisper does not support mps
+        compute_type=settings.get("compute_type", "default"),
+        cpu_threads=models.get("cpu_threads", 0) or settings.get("cpu_threads", 0),
+        num_workers=settings.get("num_workers", 1),
+    )
+    models.setdefault("whisper", {})[model_size] = model
+    # Shares the model's weights
+    models.setdefault("batched_whisper", {})[model_size] = BatchedInferencePipeline(
+        model=model
+    )
+
+
+def whisper_model(models, model_size, batched=False):
+    """
+    The Faster-Whisper model of model_size, loaded the first time it is needed.
+    """
+    if model_size not in models.get("whisper", {}):
+        print(f"Loading the {model_size} Whisper model...")
+        load_whisper(models, model_size)
+    return models["batched_whisper" if batched else "whisper"][model_size]
+
+
+def load_models(
+    load_transcription_model=True,
+    load_diarization_model=True,
+    speaker_index_path=None,
+    whisper_settings=None,
+    model_size=WHISPER_MODEL_SIZE,
+    allow_mps=True,
+):
+    """
+    Load the transcription and diarization models once for the whole run, and the speaker
+    embedding model and index when a speaker index path is given. Other Whisper sizes are
+    loaded when first needed. With allow_mps=False the diarization pipeline stays on the CPU.
+    """
+    models = {
+        # Download once, up front
+        "whisper_paths": {model_size: download_model(model_size)},
+        "whisper_settings": whisper_settings or {},
+    }
+    if load_transcription_model:
+        load_whisper(models, model_size)
+    if speaker_index_path is not None:
+        models["speaker_encoder"] = speaker_index.load_encoder()
+        models["speaker_index"] = speaker_index.SpeakerIndex(speaker_index_path)
+    if not load_diarization_model:
+        return models
+
+    # Determine device for PyTorch (mps or cpu)
+    device = (
+        torch.device("mps")
+        if allow_mps and torch.backends.mps.is_available()
+        else torch.device("cpu")
+    )
+
+    # Initialize Pyannote pipeline and set device
+    pipeline = Pipeline.from_pretrained(
+        "pyannote/speaker-diarization", use_auth_token=config.hf_authorization
+    )
+    pipeline.to(device)  # Set the device for the pipeline
+    models["pipeline"] = pipeline
+
+    return models
+
+
+def group_speaker_turns(diarization):
+    """
+    Turn a pyannote diarization into a list of turns and a list of contiguous same-speaker groups.
+    """
     # Parse diarization results into a clean format
     # Create a mapping for speaker labels
     speaker_mapping = {}
@@ -132,65 +665,846 @@ for file_counter, file_path_item in enumerate(full_file_path_list):
             }
         else:
             current_group["end"] = segment["end"]  # Extend the end time of the group
+        segment["group"] = len(grouped_segments)  # Index the turn's group will get
     grouped_segments.append(current_group)  # Add the last group
 
+    return master_dictionary, grouped_segments
+
+
+def group_pauses(audio, time_map=None, vad_method="energy"):
+    """
+    Single-speaker alternative to diarization: split the audio at pauses into groups no longer than
+    Whisper's window, all labelled "Speaker 1". Returns turns and groups shaped like group_speaker_turns.
+    """
+    if time_map is not None:
+        # The audio is already speech only, so the joins between the kept regions are the pauses
+        time_map = vad.TimeMap.from_list(time_map)
+        regions = np.stack(
+            [time_map.speech_starts, time_map.speech_starts + time_map.durations],
+            axis=1,
+        )
+        regions = np.round(regions * SAMPLE_RATE).astype(np.int64)
+    else:
+        regions = vad.speech_regions(audio, SAMPLE_RATE, method=vad_method)
+
+    master_dictionary = []
+    grouped_segments = []
+    if len(regions) == 0:
+        regions = np.array([[0, len(audio)]])  # No pauses found: one stretch of speech
+    for start, end in vad.pause_chunks(regions, SAMPLES_PER_CLIP):
+        start_time, end_time = float(start / SAMPLE_RATE), float(end / SAMPLE_RATE)
+        master_dictionary.append(
+            {
+                "start": start_time,
+                "end": end_time,
+                "label": "Speaker 1",
+                "group": len(grouped_segments),
+            }
+        )
+        grouped_segments.append(
+            {"speaker": "Speaker 1", "start": start_time, "end": end_time}
+        )
+    return master_dictionary, grouped_segments
+
+
+def format_transcript(grouped_segments):
+    # Construct output text, laid out as TranscriptWriter writes it
+    return "\n\n".join(
+        transcript_writer.format_group(
+            group["speaker"], group["start"], group["transcription"]
+        )
+        for group in grouped_segments
+    ).strip()
+
+
+def transcription_deadline(job, args):
+    """
+    The time.time() by which the file's transcript is due under --deadline or --target-rtf, or None.
+    """
+    if args.deadline is not None:
+        return job["run_start_time"] + args.deadline * 60
+    if args.target_rtf is not None:
+        file_metrics = job["metrics"]
+        return file_metrics.started + args.target_rtf * file_metrics.counters.get(
+            "audio_seconds", 0
+        )
+    return None
+
+
+def draft_pass(job, models, args, audio, completed_groups):
+    """
+    Transcribe the groups not yet completed with the draft model, write the draft transcript and
+    return the groups (index: text) confident enough to keep. The rest are to be transcribed again.
+    """
+    grouped_segments = job["grouped_segments"]
+    print(f"Drafting with the {args.draft_model} model...")
+    with metrics.span("draft_pass", model_size=args.draft_model):
+        drafts = draft_groups(
+            whisper_model(models, args.draft_model),
+            audio,
+            grouped_segments,
+            completed_groups,
+        )
+    write_draft(
+        job,
+        {
+            **completed_groups,
+            **{group_index: draft["text"] for group_index, draft in drafts.items()},
+        },
+    )
+
+    confident_groups = {
+        group_index: draft["text"]
+        for group_index, draft in drafts.items()
+        if draft["lowest_logprob"] >= args.logprob_threshold
+        and draft["highest_no_speech_prob"] <= args.no_speech_threshold
+    }
+    drafted_seconds = sum(
+        grouped_segments[group_index]["end"] - grouped_segments[group_index]["start"]
+        for group_index in drafts
+    )
+    second_pass_seconds = sum(
+        grouped_segments[group_index]["end"] - grouped_segments[group_index]["start"]
+        for group_index in drafts
+        if group_index not in confident_groups
+    )
+    metrics.count("draft_audio_seconds", drafted_seconds)
+    metrics.count("second_pass_audio_seconds", second_pass_seconds)
+    job["second_pass_fraction"] = second_pass_seconds / max(drafted_seconds, 1e-9)
+    print(
+        f"{len(drafts) - len(confident_groups)} of {len(drafts)} groups, "
+        f"{second_pass_seconds:.0f}s of {drafted_seconds:.0f}s of audio "
+        f"({job['second_pass_fraction']:.0%}), need a second pass"
+    )
+    return confident_groups
+
+
+def transcribe_audio(job, models, args, audio, writer):
     # Transcribe grouped segments
-    print(f"Transcribing file {file_counter+1} of {len(full_file_path_list)}...")
-    for group in grouped_segments:
-        speaker = group["speaker"]
-        speaker_start_ms = int(group["start"] * 1000)
-        speaker_end_ms = int(group["end"] * 1000)
+    print(f"Transcribing file {job['number']} of {job['total']}...")
+    grouped_segments = job["grouped_segments"]
+    checkpoint = job.get("checkpoint")
 
-        # Extract the audio segment in memory
-        wav_segment = audio[speaker_start_ms:speaker_end_ms]
+    def on_group_transcribed(group_index, text):
+        # Stream the group to the output file and checkpoint it
+        writer.add(group_index, text)
+        if checkpoint is not None:
+            checkpoint.append_group(group_index, text)
 
-        # Export the audio segment to a BytesIO object
-        audio_buffer = BytesIO()
-        wav_segment.export(audio_buffer, format="wav")
-        audio_buffer.seek(0)  # Move to the start of the buffer
+    completed_groups = (
+        checkpoint.load_groups() if checkpoint and args.mode == "groups" else {}
+    )
+    for group_index, text in completed_groups.items():
+        writer.add(group_index, text)
+    if args.draft_model is not None:
+        # The confident drafts are final, so they are treated like transcribed groups
+        confident_groups = draft_pass(job, models, args, audio, completed_groups)
+        for group_index, text in confident_groups.items():
+            on_group_transcribed(group_index, text)
+        completed_groups = {**completed_groups, **confident_groups}
+    schedule = model_selection.ModelSchedule(
+        model_selection.ThroughputHistory(args.cache_dir),
+        args.mode,
+        args.model,
+        sum(
+            group["end"] - group["start"]
+            for group_index, group in enumerate(grouped_segments)
+            if group_index not in completed_groups
+        ),
+        deadline=transcription_deadline(job, args),
+    )
+    model = whisper_model(models, schedule.model_size, batched=args.mode == "batched")
+    transcribe_start_time = time.time()
+    if args.mode == "batched":
+        transcriptions = transcribe_groups_batched(
+            model, audio, grouped_segments, args.batch_size
+        )
+    elif args.mode == "words":
+        transcriptions = transcribe_words(
+            model, audio, job["master_dictionary"], grouped_segments
+        )
+    else:
+
+        def on_group_timed(audio_seconds, seconds):
+            # A smaller model takes over when transcription falls behind the deadline
+            if schedule.record(audio_seconds, seconds):
+                return whisper_model(models, schedule.model_size)
+
+        # Resume from, and keep adding to, the groups checkpointed so far
+        transcriptions = transcribe_groups(
+            model,
+            audio,
+            grouped_segments,
+            completed_groups=completed_groups,
+            on_group_transcribed=on_group_transcribed,
+            on_group_timed=on_group_timed,
+        )
+    transcribe_elapsed = time.time() - transcribe_start_time
+    if args.mode != "groups":
+        schedule.record(schedule.remaining_audio, transcribe_elapsed)
+    schedule.save_history()
+
+    # Optionally time the per-group loop on the same file for comparison
+    if args.compare_modes and args.mode != "groups":
+        loop_start_time = time.time()
+        transcribe_groups(
+            whisper_model(models, schedule.model_size), audio, grouped_segments
+        )
+        loop_elapsed = time.time() - loop_start_time
+        print(
+            f"Transcription took {transcribe_elapsed:.1f}s in {args.mode} mode and {loop_elapsed:.1f}s in groups mode "
+            f"({loop_elapsed / max(transcribe_elapsed, 1e-9):.2f}x speedup over {len(grouped_segments)} groups)"
+        )
+
+    return transcriptions
+
+
+# Pipeline stages. Each takes the job dictionary for one file and adds its results to it.
+def decode_stage(job, models, args):
+    checkpoint = job.get("checkpoint")
+    if checkpoint is not None and checkpoint.load_transcript() is not None:
+        print(f"Resuming {job['file_path']} from its checkpointed transcript...")
+        return  # The audio is not needed again
+
+    # Decode the audio (from a video or audio file) once into a 16 kHz mono buffer
+    print(f"Extracting audio from: {job['file_path']}...")
+    if args.stream_decode:
+        # The buffer lives in an unlinked temporary file in the cache directory, not in RAM
+        Path(args.cache_dir).mkdir(parents=True, exist_ok=True)
+        decoder = StreamingDecoder(
+            job["file_path"],
+            sample_rate=SAMPLE_RATE,
+            chunk_seconds=args.decode_chunk_seconds,
+            expected_seconds=media_duration(job["file_path"]),
+            temporary_dir=args.cache_dir,
+        )
+        job["audio"] = decoder.result()
+    else:
+        job["audio"] = extract_audio_from_video(job["file_path"])
+    metrics.count("audio_seconds", len(job["audio"]) / SAMPLE_RATE)
+
+    if args.vad != "off":
+        audio_seconds = len(job["audio"]) / SAMPLE_RATE
+        job["audio"], time_map, job["skipped_seconds"] = vad.remove_non_speech(
+            job["audio"],
+            SAMPLE_RATE,
+            method=args.vad,
+            temporary_dir=args.cache_dir if args.stream_decode else None,
+        )
+        job["time_map"] = time_map.as_list()
+        metrics.count("skipped_seconds", job["skipped_seconds"])
+        print(
+            f"Skipped {job['skipped_seconds']:.1f}s of {audio_seconds:.1f}s as non-speech "
+            f"({job['skipped_seconds'] / max(audio_seconds, 1e-9):.0%})"
+        )
+
+
+def speaker_count_hints(args):
+    """
+    The speaker-count options that were given, as keyword arguments for the pyannote pipeline.
+    """
+    hints = {
+        "num_speakers": args.num_speakers,
+        "min_speakers": args.min_speakers,
+        "max_speakers": args.max_speakers,
+    }
+    return {name: value for name, value in hints.items() if value is not None}
+
+
+def diarize_stage(job, models, args):
+    checkpoint = job.get("checkpoint")
+    checkpointed_diarization = (
+        checkpoint.load_diarization() if checkpoint is not None else None
+    )
+    if checkpointed_diarization is not None:
+        job["master_dictionary"], job["grouped_segments"], job["time_map"] = (
+            checkpointed_diarization
+        )
+        return
+
+    if args.no_diarize:
+        job["master_dictionary"], job["grouped_segments"] = group_pauses(
+            job["audio"],
+            job.get("time_map"),
+            vad_method=args.vad if args.vad != "off" else "energy",
+        )
+    else:
+        print(f"Diarizing file {job['number']} of {job['total']}...")
+        window_seconds = args.diarize_window * 60
+        if 0 < window_seconds < len(job["audio"]) / SAMPLE_RATE:
+            # A window may hold fewer speakers than the whole file, so counts become upper bounds
+            hints = speaker_count_hints(args)
+            window_hints = {}
+            if "num_speakers" in hints or "max_speakers" in hints:
+                window_hints["max_speakers"] = hints.get(
+                    "num_speakers", hints.get("max_speakers")
+                )
+            diarization = windowed_diarization.diarize_windowed(
+                models["pipeline"],
+                job["audio"],
+                SAMPLE_RATE,
+                window_seconds=window_seconds,
+                overlap_seconds=args.diarize_overlap,
+                uri=job["file_name"],
+                workers=args.diarize_workers,
+                **window_hints,
+            )
+        else:
+            # Speaker diarization using pyannote.audio on an in-memory waveform tensor
+            waveform = torch.from_numpy(job["audio"]).unsqueeze(0)  # (channel, time)
+            diarization = models["pipeline"](
+                {
+                    "uri": job["file_name"],
+                    "waveform": waveform,
+                    "sample_rate": SAMPLE_RATE,
+                },
+                **speaker_count_hints(args),
+            )
+        job["master_dictionary"], job["grouped_segments"] = group_speaker_turns(
+            diarization
+        )
+
+    if args.identify_speakers:
+        # The embeddings of this file's speakers are kept so they are never computed twice.
+        # They only depend on the file and its speaker turns, not on the enrolled people.
+        embeddings_path = None
+        if "content_hash" in job:
+            embeddings_key = result_cache.cache_key(
+                job["content_hash"], diarization_settings(args)
+            )
+            embeddings_path = Path(args.cache_dir).joinpath(
+                "speaker_embeddings", f"{embeddings_key}.npz"
+            )
+        renames = speaker_index.name_speakers(
+            models["speaker_encoder"],
+            models["speaker_index"],
+            job["audio"],
+            job["master_dictionary"],
+            job["grouped_segments"],
+            embeddings_path=embeddings_path,
+            threshold=args.speaker_threshold,
+        )
+        for label, name in renames.items():
+            print(f"{label} is {name}")
+    if checkpoint is not None:
+        checkpoint.save_diarization(
+            job["master_dictionary"], job["grouped_segments"], job.get("time_map")
+        )
 
-        # Transcribe the in-memory audio segment
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            segments, info = model.transcribe(audio_buffer, beam_size=5, language="en")
 
-        # Combine transcribed text
-        all_transcribed_lines = [segment.text.strip() for segment in segments]
-        transcription = " ".join(all_transcribed_lines).strip()
+def restore_original_times(job, grouped_segments):
+    """
+    Move the group times from the speech-only clock back to the original recording's clock.
+    """
+    if job.get("time_map") is not None:
+        time_map = vad.TimeMap.from_list(job["time_map"])
+        for group in grouped_segments:
+            group["start"] = time_map.to_original(group["start"])
+            group["end"] = time_map.to_original(group["end"], is_end=True)
+
+
+def draft_path(job):
+    return Path(job["file_parent"]).joinpath(f"{job['file_name']}.draft.txt")
+
 
-        # Add transcription to the group's data
-        group["transcription"] = transcription
+def write_draft(job, transcriptions):
+    """
+    Write the transcript as it stands (index: text, missing groups left empty) so it can be read
+    while the second pass runs. It is removed once the final output is written.
+    """
+    groups = [
+        {**group, "transcription": transcriptions.get(group_index, "")}
+        for group_index, group in enumerate(job["grouped_segments"])
+    ]
+    restore_original_times(job, groups)
+    with open(draft_path(job), "w") as file:
+        file.write(format_transcript(groups))
+    print(f"Draft transcript written to {draft_path(job)}")
 
-    # Construct output text
-    transcribed_text_list = []
-    for group in grouped_segments:
-        new_speaker = group["speaker"]
-        new_speaker_start_time = str(
-            datetime.timedelta(seconds=int(group["start"]))
-        )  # Format as H:M:S
 
-        # Add the speaker and timestamp line
-        transcribed_text_list.append(f"\n\n{new_speaker} [{new_speaker_start_time}]\n")
-        transcribed_text_list.append(group["transcription"])
+def output_path(job):
+    return Path(job["file_parent"]).joinpath(f"{job['file_name']}.txt")
 
-    # Post-process the list into a single string
-    transcribed_text = "".join(transcribed_text_list).strip()
 
-    # Summarize the transcribed text
-    summary_length = 300
-    summary = summarise.summarise(transcribed_text, summary_length)
+def sidecar_path(job):
+    return Path(job["file_parent"]).joinpath(f"{job['file_name']}.jsonl")
 
-    # Extract meeting actions
-    actions = summarise.find_actions(transcribed_text)
-    summarised_transcribed_text = "\n\n\n".join([summary, actions, transcribed_text])
 
-    # Save to text file
-    text_file_path = Path(file_parent).joinpath(f"{file_name}.txt")
-    with open(text_file_path, "w") as file:
-        file.write(summarised_transcribed_text)
+def transcribe_stage(job, models, args):
+    checkpoint = job.get("checkpoint")
+    audio = job.pop("audio", None)  # The audio is not needed after this stage
+
+    # The transcript goes straight to the output file, group by group, and is read back from there
+    job["transcript_path"] = output_path(job)
+    with transcript_writer.TranscriptWriter(
+        job["transcript_path"],
+        sidecar_path(job),
+        job["grouped_segments"],
+        time_map=(
+            vad.TimeMap.from_list(job["time_map"])
+            if job.get("time_map") is not None
+            else None
+        ),
+    ) as writer:
+        transcriptions = (
+            checkpoint.load_transcript() if checkpoint is not None else None
+        )
+        if transcriptions is None:
+            transcriptions = transcribe_audio(job, models, args, audio, writer)
+            if checkpoint is not None:
+                checkpoint.save_transcript(transcriptions)
+        # Writes whatever was not streamed: every group in batched and words modes or on resume
+        writer.add_all(transcriptions)
 
-    # End timing
-    elapsed_time = time.time() - start_time
+
+def summarise_stage(job, models, args):
+    checkpoint = job.get("checkpoint")
+    checkpointed_summary = checkpoint.load_summary() if checkpoint is not None else None
+    if checkpointed_summary is not None:
+        job.update(checkpointed_summary)
+        return
+
+    transcribed_text = Path(job["transcript_path"]).read_text()
+
+    if args.combined_summary:
+        # Summary and meeting actions from a single pass over the transcript
+        job["summary"], job["actions"] = summarise.summarise_and_find_actions(
+            transcribed_text, SUMMARY_LENGTH, concurrency=args.llm_concurrency
+        )
+    else:
+        # Summarize the transcribed text
+        job["summary"] = summarise.summarise(
+            transcribed_text, SUMMARY_LENGTH, concurrency=args.llm_concurrency
+        )
+
+        # Extract meeting actions
+        job["actions"] = summarise.find_actions(transcribed_text)
+    if checkpoint is not None:
+        checkpoint.save_summary(job["summary"], job["actions"])
+
+
+def write_output(job):
+    # Put the summary and actions in front of the streamed transcript, or write a cached result whole
+    job["output_path"] = output_path(job)
+    transcript_writer.insert_summary(
+        job["output_path"],
+        job["summary"],
+        job["actions"],
+        transcribed_text=job.get("transcribed_text"),
+    )
+    draft_path(job).unlink(missing_ok=True)  # Superseded by the final transcript
+
+    # End timing of this file
+    elapsed_time = (
+        job["metrics"].elapsed()
+        if job.get("metrics") is not None
+        else time.time() - job["run_start_time"]
+    )
     elapsed_minutes = int(elapsed_time / 60)
     elapsed_seconds = int(elapsed_time % 60)
     print(f"Elapsed time: {elapsed_minutes:.0f}:{elapsed_seconds:.2f}")
+
+
+def write_stage(job, models, args):
+    # Read before the summary goes in front of it
+    if args.cache is not None:
+        transcribed_text = Path(job["transcript_path"]).read_text()
+        group_records = transcript_writer.read_sidecar(sidecar_path(job))
+    write_output(job)
+
+    # Remember the result so an unchanged file is not processed again
+    if args.cache is not None:
+        args.cache.put(
+            job["cache_key"],
+            {
+                "summary": job["summary"],
+                "actions": job["actions"],
+                "transcribed_text": transcribed_text,
+                "group_records": group_records,
+            },
+        )
+
+    # The file is finished, so its checkpoints are no longer needed
+    if job.get("checkpoint") is not None:
+        job["checkpoint"].remove()
+
+
+def make_job(file_path_item, file_counter, total, run_start_time):
+    return {
+        "file_path": file_path_item,
+        "file_name": Path(file_path_item).stem,
+        "file_parent": Path(file_path_item).parents[0],
+        "number": file_counter + 1,
+        "total": total,
+        "run_start_time": run_start_time,
+        "metrics": metrics.FileMetrics(file_path_item),
+    }
+
+
+def report_progress(job, stage_name, status):
+    if job.get("on_progress") is not None:
+        job["on_progress"]({"stage": stage_name, "status": status})
+
+
+def run_stage(job, stage_name, stage, models, args):
+    """
+    Run one stage as a timed span of the file's metrics, reporting its progress, and profile it
+    with --profile.
+    """
+    report_progress(job, stage_name, "started")
+    profile_stage = contextlib.nullcontext()
+    if args.profile:
+        if "profiler" not in job:
+            job["profiler"] = profiling.StageProfiler(
+                job["file_parent"], job["file_name"]
+            )
+        profile_stage = job["profiler"].profile(stage_name)
+    with metrics.activate(job["metrics"]), metrics.span(stage_name, stage=True):
+        with profile_stage:
+            stage(job, models, args)
+    report_progress(job, stage_name, "finished")
+
+
+def finish_metrics(job, args):
+    """
+    Append the file's metrics record to the metrics file, add it to the run totals and return it.
+    """
+    if job.get("profiler") is not None:
+        print(f"Profile written to {job['profiler'].write_report()}")
+    record = job["metrics"].as_record()
+    metrics.append_record(
+        args.metrics_file or Path(args.cache_dir).joinpath("metrics.jsonl"), record
+    )
+    metrics.registry.observe(record)
+    return record
+
+
+def process_file(job, models, args):
+    """
+    Run every stage for one file, one after the other.
+    """
+    for stage_name, stage in (
+        ("decode", decode_stage),
+        ("diarize", diarize_stage),
+        ("transcribe", transcribe_stage),
+        ("summarise", summarise_stage),
+        ("write", write_stage),
+    ):
+        run_stage(job, stage_name, stage, models, args)
+    job["metrics_record"] = finish_metrics(job, args)
+    return job
+
+
+def run_pipelined(jobs, models, args):
+    """
+    Run the files through a bounded-queue pipeline so the CPU-bound and network-bound stages overlap.
+    """
+
+    def bind(*stages, last=False):
+        def run_stages(job):
+            for stage_name, stage in stages:
+                run_stage(job, stage_name, stage, models, args)
+            if last:
+                finish_metrics(job, args)
+
+        return run_stages
+
+    stages = [
+        ("decode", bind(("decode", decode_stage))),
+        ("diarize", bind(("diarize", diarize_stage))),
+        ("transcribe", bind(("transcribe", transcribe_stage))),
+        (
+            "summarise",
+            bind(("summarise", summarise_stage), ("write", write_stage), last=True),
+        ),
+    ]
+    finished_jobs, queue_metrics, stage_times = staged_pipeline.run_pipelined(
+        jobs, stages, queue_size=args.queue_size
+    )
+
+    # Report how busy each stage was and how full the queues between them got
+    for name, busy_seconds in stage_times.items():
+        print(f"Stage {name} was busy for {busy_seconds:.1f}s")
+    for queue_stats in queue_metrics:
+        print(
+            f"Queue {queue_stats['queue']}: max depth {queue_stats['max_depth']}, mean depth {queue_stats['mean_depth']:.2f}, "
+            f"producer blocked {queue_stats['producer_blocked_seconds']:.1f}s, consumer waiting {queue_stats['consumer_waiting_seconds']:.1f}s"
+        )
+    failed_jobs = [job for job in finished_jobs if "error" in job]
+    if failed_jobs:
+        print(f"{len(failed_jobs)} of {len(finished_jobs)} files failed")
+
+    return finished_jobs
+
+
+def diarization_settings(args):
+    """
+    Every setting that changes the speaker turns found in a file.
+    """
+    return {
+        "vad": args.vad,
+        "diarize": not args.no_diarize,
+        "diarize_window": args.diarize_window,
+        "diarize_overlap": args.diarize_overlap,
+        **speaker_count_hints(args),
+    }
+
+
+def whisper_settings(args):
+    """
+    The Whisper settings tune.py saved for this machine by model size, unless they are to be ignored.
+    """
+    if args.no_machine_profile:
+        return {}
+    return machine_profile.load_profiles(args.cache_dir)
+
+
+def result_settings(args):
+    """
+    Every setting that changes the written output, for the result cache key.
+    """
+    return {
+        "whisper_model": args.model,
+        "deadline": args.deadline,
+        "target_rtf": args.target_rtf,
+        # Which groups get a second pass depends on the draft and its thresholds
+        "draft": (
+            [args.draft_model, args.logprob_threshold, args.no_speech_threshold]
+            if args.draft_model is not None
+            else None
+        ),
+        "compute_types": {
+            model_size: settings.get("compute_type", "default")
+            for model_size, settings in whisper_settings(args).items()
+        },
+        "mode": args.mode,
+        "batch_size": args.batch_size,
+        **diarization_settings(args),
+        # Enrolling someone changes the names written, so the index content is part of the key
+        "speaker_index": (
+            result_cache.hash_file(args.speaker_index)
+            if args.identify_speakers and os.path.exists(args.speaker_index)
+            else None
+        ),
+        "speaker_threshold": args.speaker_threshold if args.identify_speakers else None,
+        "summary_length": SUMMARY_LENGTH,
+        "combined_summary": args.combined_summary,
+        "llm_model": summarise.DEFAULT_MODEL,
+        "prompt_version": summarise.PROMPT_VERSION,
+    }
+
+
+def assign_cache_keys(jobs, args):
+    settings = result_settings(args)
+    for job in jobs:
+        job["content_hash"] = result_cache.hash_file(job["file_path"])
+        job["cache_key"] = result_cache.cache_key(job["content_hash"], settings)
+
+
+def take_cached_results(jobs, args):
+    """
+    Write the output of every file whose result is already cached and return the jobs still to do.
+    """
+    remaining_jobs = []
+    for job in jobs:
+        cached_result = args.cache.get(job["cache_key"])
+        # Results cached without their group records cannot rewrite the sidecar
+        if cached_result is None or "group_records" not in cached_result:
+            remaining_jobs.append(job)
+            continue
+        print(f"Using the cached result for file {job['number']} of {job['total']}...")
+        job.update(cached_result)
+        transcript_writer.write_sidecar(sidecar_path(job), job["group_records"])
+        write_output(job)
+    return remaining_jobs
+
+
+def media_duration(file_path):
+    """
+    Return the duration of a media file in seconds from its container metadata, or 0 if unknown.
+    """
+    try:
+        return float(ffmpeg.probe(file_path)["format"]["duration"])
+    except (ffmpeg.Error, KeyError, ValueError):
+        return 0.0
+
+
+# State inherited by forked workers. It is set in the parent before the fork so the
+# loaded diarization weights are shared copy-on-write rather than pickled.
+_worker_state = {}
+
+
+def _init_worker(threads_per_worker):
+    torch.set_num_threads(threads_per_worker)
+    # CTranslate2 starts its own thread pool when a model is constructed and those threads
+    # do not survive a fork, so each worker builds its Whisper model from the downloaded files
+    load_whisper(
+        _worker_state["models"],
+        _worker_state["args"].model,
+        cpu_threads=threads_per_worker,
+    )
+
+
+def _process_in_worker(job):
+    try:
+        process_file(job, _worker_state["models"], _worker_state["args"])
+    except Exception as error:
+        print(f"Failed {job['file_path']}: {error!r}")
+        return {"file_path": job["file_path"], "error": repr(error)}
+    # The worker's totals die with it, so the parent adds the record to its own
+    return {"file_path": job["file_path"], "metrics": job["metrics_record"]}
+
+
+def run_workers(jobs, models, args):
+    """
+    Process the files in a pool of forked workers, longest file first so the load stays balanced.
+    """
+    durations = {job["file_path"]: media_duration(job["file_path"]) for job in jobs}
+    jobs = sorted(jobs, key=lambda job: durations[job["file_path"]], reverse=True)
+
+    threads_per_worker = max(1, (os.cpu_count() or 1) // args.workers)
+    print(
+        f"Processing {len(jobs)} files with {args.workers} workers of {threads_per_worker} threads each..."
+    )
+    _worker_state["models"] = models
+    _worker_state["args"] = args
+    context = multiprocessing.get_context("fork")
+    with context.Pool(
+        processes=args.workers,
+        initializer=_init_worker,
+        initargs=(threads_per_worker,),
+    ) as pool:
+        results = list(pool.imap_unordered(_process_in_worker, jobs, chunksize=1))
+    for result in results:
+        if "metrics" in result:
+            metrics.registry.observe(result["metrics"])
+
+    failed_results = [result for result in results if "error" in result]
+    if failed_results:
+        print(f"{len(failed_results)} of {len(results)} files failed")
+
+    return results
+
+
+def prepare_jobs(jobs, args):
+    """
+    Write the files whose results are cached and attach checkpoints to the rest, which are returned.
+    """
+    if args.cache is not None or not args.no_checkpoint:
+        assign_cache_keys(jobs, args)
+    if args.cache is not None:
+        jobs = take_cached_results(jobs, args)
+    if not args.no_checkpoint:
+        for job in jobs:
+            job["checkpoint"] = Checkpoint(args.cache_dir, job["cache_key"])
+    return jobs
+
+
+def configure_run(args):
+    """
+    Set up the result cache, the LLM request scheduler and the LLM completion cache from the arguments.
+    """
+    args.cache = (
+        None
+        if args.no_cache
+        else result_cache.ResultCache(args.cache_dir, args.cache_size * 1024 * 1024)
+    )
+    summarise.configure_scheduler(
+        requests_per_minute=args.llm_rpm,
+        tokens_per_minute=args.llm_tpm,
+        retry_budget=args.llm_retry_budget,
+    )
+    if not args.no_llm_cache:
+        Path(args.cache_dir).mkdir(parents=True, exist_ok=True)
+        summarise.configure_completion_cache(
+            Path(args.cache_dir).joinpath("completions.sqlite"),
+            args.llm_cache_size * 1024 * 1024,
+        )
+
+
+def serve_jobs(models, args):
+    """
+    Keep the models loaded and process files submitted over the local job API one at a time.
+    """
+
+    def process(file_path, on_progress, submitted):
+        # A --deadline counts from when the file was submitted, not from when it starts
+        job = make_job(file_path, 0, 1, submitted)
+        job["on_progress"] = on_progress
+        # Each submitted file gets the whole --llm-retry-budget
+        summarise.scheduler.reset_retries()
+        if prepare_jobs([job], args):
+            process_file(job, models, args)
+            if args.prometheus_file:
+                metrics.registry.write(args.prometheus_file)
+        else:
+            on_progress({"stage": "cache", "status": "hit"})
+        return job["output_path"]
+
+    service.serve(
+        process,
+        port=args.port,
+        socket_path=args.socket,
+        render_metrics=metrics.registry.render,
+    )
+
+
+def main():
+    # Start timing
+    start_time = time.time()
+
+    args = parse_arguments()
+    configure_run(args)
+
+    if args.serve:
+        serve_jobs(
+            load_models(
+                load_diarization_model=not args.no_diarize,
+                speaker_index_path=(
+                    args.speaker_index if args.identify_speakers else None
+                ),
+                whisper_settings=whisper_settings(args),
+                model_size=args.model,
+            ),
+            args,
+        )
+        return
+
+    full_file_path_list = collect_file_paths(args.file_path)
+    jobs = [
+        make_job(file_path_item, file_counter, len(full_file_path_list), start_time)
+        for file_counter, file_path_item in enumerate(full_file_path_list)
+    ]
+    jobs = prepare_jobs(jobs, args)
+    if not jobs:
+        return
+
+    # Diarization and transcription model initialization
+    models = load_models(
+        load_transcription_model=args.workers <= 1,
+        load_diarization_model=not args.no_diarize,
+        speaker_index_path=args.speaker_index if args.identify_speakers else None,
+        whisper_settings=whisper_settings(args),
+        model_size=args.model,
+        # Forking after Metal has been initialised crashes or hangs the workers
+        allow_mps=args.workers <= 1,
+    )
+
+    if args.workers > 1:
+        run_workers(jobs, models, args)
+    elif args.pipeline:
+        run_pipelined(jobs, models, args)
+    else:
+        for job in jobs:
+            process_file(job, models, args)
+
+    if args.prometheus_file:
+        metrics.registry.write(args.prometheus_file)
+    if summarise.completion_cache is not None:
+        print(
+            f"LLM completion cache: {summarise.completion_cache.hits} hits, {summarise.completion_cache.misses} misses"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import datetime
+import json
+import os
+import shutil
+from pathlib import Path
+
+
+def format_group(speaker, start, transcription):
+    """
+    A speaker group as it appears in the transcript: the speaker and start time (H:M:S), then the text.
+    """
+    return f"{speaker} [{datetime.timedelta(seconds=int(start))}]\n{transcription}"
+
+
+class TranscriptWriter:
+    """
+    Appends each speaker group to the transcript file, and a JSON line for it to the sidecar, as
+    soon as it and every group before it are transcribed. A long recording can be read while it is
+    still being processed, and the text does not have to be held in memory until the end.
+    """
+
+    def __init__(self, text_path, jsonl_path, grouped_segments, time_map=None):
+        self.grouped_segments = grouped_segments
+        # Maps the group times back to the original recording's clock
+        self.time_map = time_map
+        self.next_group = 0
+        self.pending = {}  # Groups finished ahead of an earlier one (index: text)
+        self.text_file = open(text_path, "w")
+        self.jsonl_file = open(jsonl_path, "w")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, group_index, transcription):
+        """
+        Add a transcribed group. Groups already written are ignored, so adding all of them at the
+        end is safe.
+        """
+        if group_index < self.next_group:
+            return
+        self.pending[group_index] = transcription
+        while self.next_group in self.pending:
+            self._write(self.next_group, self.pending.pop(self.next_group))
+            self.next_group += 1
+        self.text_file.flush()
+        self.jsonl_file.flush()
+
+    def add_all(self, transcriptions):
+        for group_index, transcription in enumerate(transcriptions):
+            self.add(group_index, transcription)
+
+    def _write(self, group_index, transcription):
+        group = self.grouped_segments[group_index]
+        start, end = group["start"], group["end"]
+        if self.time_map is not None:
+            start = self.time_map.to_original(start)
+            end = self.time_map.to_original(end, is_end=True)
+        text = format_group(group["speaker"], start, transcription)
+        if group_index > 0:
+            self.text_file.write("\n\n")
+        if group_index == len(self.grouped_segments) - 1:
+            # No newline at the end of the file, even when the last group's text is empty
+            text = text.rstrip()
+        self.text_file.write(text)
+        self.jsonl_file.write(
+            json.dumps(
+                {
+                    "group": group_index,
+                    "speaker": group["speaker"],
+                    "start": round(float(start), 3),
+                    "end": round(float(end), 3),
+                    "transcription": transcription,
+                }
+            )
+            + "\n"
+        )
+
+    def close(self):
+        self.text_file.close()
+        self.jsonl_file.close()
+
+
+def read_sidecar(path):
+    """
+    The JSON records of the groups in a sidecar file, in order.
+    """
+    with open(path) as file:
+        return [json.loads(line) for line in file]
+
+
+def write_sidecar(path, records):
+    """
+    Write the sidecar whole from records read back with read_sidecar (a cached result).
+    """
+    with open(path, "w") as file:
+        for record in records:
+            file.write(json.dumps(record) + "\n")
+
+
+def insert_summary(path, summary, actions, transcribed_text=None):
+    """
+    Put the summary and actions in front of the transcript in one atomic rewrite, so a reader sees
+    either the transcript alone or the finished output. The transcript is copied from the file in
+    blocks, or taken from transcribed_text when given (a cached result).
+    """
+    path = Path(path)
+    temporary_path = path.with_suffix(".tmp")
+    with open(temporary_path, "w") as file:
+        file.write("\n\n\n".join([summary, actions]) + "\n\n\n")
+        if transcribed_text is not None:
+            file.write(transcribed_text)
+        else:
+            with open(path) as transcript_file:
+                shutil.copyfileobj(transcript_file, file)
+    os.replace(temporary_path, path)
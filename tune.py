@@ -0,0 +1,202 @@
+import argparse
+import datetime
+import os
+import re
+import time
+import warnings
+import numpy as np
+from faster_whisper import WhisperModel
+from faster_whisper.utils import download_model
+import machine_profile
+import result_cache
+from model_selection import MODEL_SIZES
+from transcribe_video import SAMPLE_RATE, WHISPER_MODEL_SIZE, extract_audio_from_video
+
+COMPUTE_TYPES = ["int8", "int8_float32", "float32"]
+# The speaker and timestamp lines transcribe_video.py writes, e.g. "Speaker 1 [0:01:23]"
+HEADER_LINE = re.compile(r"^.*\[\d+:\d{2}:\d{2}\]\s*$")
+
+
+def thread_counts(cpu_count=None):
+    """
+    Powers of two up to the number of CPUs, plus the number of CPUs itself.
+    """
+    cpu_count = cpu_count or os.cpu_count() or 1
+    counts = []
+    threads = 1
+    while threads < cpu_count:
+        counts.append(threads)
+        threads *= 2
+    counts.append(cpu_count)
+    return counts
+
+
+def normalise_words(text):
+    """
+    Lower-case words without punctuation, skipping speaker and timestamp lines so a transcript
+    written by transcribe_video.py can serve as the reference.
+    """
+    lines = [line for line in text.splitlines() if not HEADER_LINE.match(line)]
+    return re.sub(r"[^\w\s']", " ", " ".join(lines).lower()).split()
+
+
+def word_error_rate(reference, hypothesis):
+    """
+    Word-level edit distance between the two texts divided by the number of reference words.
+    """
+    reference_words = normalise_words(reference)
+    hypothesis_words = normalise_words(hypothesis)
+    if not reference_words:
+        return 0.0 if not hypothesis_words else 1.0
+
+    # One row of the edit distance table at a time
+    previous = np.arange(len(hypothesis_words) + 1)
+    for row, reference_word in enumerate(reference_words, start=1):
+        current = np.empty_like(previous)
+        current[0] = row
+        for column, hypothesis_word in enumerate(hypothesis_words, start=1):
+            current[column] = min(
+                previous[column] + 1,  # Deletion
+                current[column - 1] + 1,  # Insertion
+                previous[column - 1] + (reference_word != hypothesis_word),
+            )
+        previous = current
+    return previous[-1] / len(reference_words)
+
+
+def time_transcription(model, audio, repeats):
+    """
+    Transcribe the audio as transcribe_video.py does and return the fastest of `repeats` runs in
+    seconds, with the text of the last run.
+    """
+    best_seconds = float("inf")
+    text = ""
+    for _ in range(repeats):
+        start = time.perf_counter()
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            segments, info = model.transcribe(audio, beam_size=5, language="en")
+            text = " ".join(segment.text.strip() for segment in segments)
+        best_seconds = min(best_seconds, time.perf_counter() - start)
+    return best_seconds, text
+
+
+def calibrate(model_path, audio, reference, compute_types, threads, repeats):
+    """
+    Time every compute type at every thread count and measure the word error rate of each.
+    Returns one result per combination.
+    """
+    audio_seconds = len(audio) / SAMPLE_RATE
+    results = []
+    for compute_type in compute_types:
+        for cpu_threads in threads:
+            model = WhisperModel(
+                model_path,
+                device="cpu",
+                compute_type=compute_type,
+                cpu_threads=cpu_threads,
+            )
+            # Warm up; the segments are a generator, so nothing is decoded until they are read
+            list(model.transcribe(audio[: 5 * SAMPLE_RATE], language="en")[0])
+            seconds, text = time_transcription(model, audio, repeats)
+            result = {
+                "compute_type": compute_type,
+                "cpu_threads": cpu_threads,
+                "seconds_per_audio_second": seconds / audio_seconds,
+                "wer": word_error_rate(reference, text),
+            }
+            print(
+                f"{compute_type:>13}, {cpu_threads:>3} threads: "
+                f"{result['seconds_per_audio_second']:.3f}s per second of audio, "
+                f"WER {result['wer']:.3f}"
+            )
+            results.append(result)
+    return results
+
+
+def choose_fastest(results, wer_tolerance):
+    """
+    The fastest result whose word error rate is within wer_tolerance of the most accurate one.
+    """
+    best_wer = min(result["wer"] for result in results)
+    accurate = [
+        result for result in results if result["wer"] <= best_wer + wer_tolerance
+    ]
+    return min(accurate, key=lambda result: result["seconds_per_audio_second"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Tune",
+        description="Find the fastest Whisper compute type and thread count on this machine that "
+        "keeps the word error rate on a reference recording, and save them for transcribe_video.py",
+    )
+    parser.add_argument(
+        "reference_media", help="A short recording, a minute or two is enough"
+    )
+    parser.add_argument(
+        "reference_transcript",
+        help="A correct transcript of the recording (a transcribe_video.py .txt file without its summary will do)",
+    )
+    parser.add_argument(
+        "--model",
+        choices=MODEL_SIZES,
+        default=WHISPER_MODEL_SIZE,
+        help="Whisper model size to tune; each size has its own profile",
+    )
+    parser.add_argument(
+        "--compute-types",
+        nargs="+",
+        default=COMPUTE_TYPES,
+        help="CTranslate2 compute types to try",
+    )
+    parser.add_argument(
+        "--threads",
+        nargs="+",
+        type=int,
+        default=thread_counts(),
+        help="Thread counts to try (default: powers of two up to the number of CPUs)",
+    )
+    parser.add_argument(
+        "--wer-tolerance",
+        type=float,
+        default=0.02,
+        help="How much higher than the most accurate setting's word error rate is acceptable",
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=2,
+        help="Runs per setting; the fastest is kept",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=result_cache.DEFAULT_CACHE_DIR,
+        help="The cache directory transcribe_video.py uses, where the profile is saved",
+    )
+    args = parser.parse_args()
+
+    audio = extract_audio_from_video(args.reference_media)
+    with open(args.reference_transcript) as file:
+        reference = file.read()
+    results = calibrate(
+        download_model(args.model),
+        audio,
+        reference,
+        args.compute_types,
+        args.threads,
+        args.repeats,
+    )
+    fastest = choose_fastest(results, args.wer_tolerance)
+    profile = {
+        **fastest,
+        # transcribe_video.py transcribes one piece of audio at a time per model
+        "num_workers": 1,
+        "cpu_count": os.cpu_count(),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+    machine_profile.save_profile(args.cache_dir, args.model, profile)
+    print(
+        f"Saved {fastest['compute_type']} with {fastest['cpu_threads']} threads for the "
+        f"{args.model} model to {machine_profile.profile_path(args.cache_dir)}"
+    )
@@ -0,0 +1,189 @@
+import tempfile
+import numpy as np
+
+
+class TimeMap:
+    """
+    Maps times on the clock of speech-only audio (the kept regions joined end to end) back to the
+    clock of the original recording.
+    """
+
+    def __init__(self, original_starts, durations):
+        self.original_starts = np.asarray(original_starts, dtype=np.float64)
+        self.durations = np.asarray(durations, dtype=np.float64)
+        self.speech_starts = np.concatenate(([0.0], np.cumsum(self.durations)[:-1]))
+
+    def to_original(self, speech_times, is_end=False):
+        """
+        Map one time or an array of times. An end time that falls exactly on the join between two
+        regions is mapped to the end of the earlier region rather than the start of the later one.
+        """
+        if len(self.durations) == 0:
+            return speech_times
+        times = np.asarray(speech_times, dtype=np.float64)
+        region = np.searchsorted(
+            self.speech_starts, times, side="left" if is_end else "right"
+        )
+        region = np.clip(region - 1, 0, len(self.durations) - 1)
+        original_times = self.original_starts[region] + (
+            times - self.speech_starts[region]
+        )
+        return original_times if original_times.ndim else float(original_times)
+
+    def as_list(self):
+        return [self.original_starts.tolist(), self.durations.tolist()]
+
+    @classmethod
+    def from_list(cls, data):
+        return cls(*data)
+
+
+def energy_speech_regions(
+    audio,
+    sample_rate=16000,
+    frame_seconds=0.03,
+    floor_db=-50.0,
+    margin_db=12.0,
+    speech_range_db=30.0,
+    block_frames=2000,
+):
+    """
+    Vectorized energy detector: returns (start, end) sample pairs of frames louder than both an
+    absolute floor and the estimated noise floor plus a margin. Frames are measured in blocks so a
+    memory-mapped recording is never copied whole. The threshold is never more than
+    `speech_range_db` below the level of the loud speech, so a quiet speaker in a recording with
+    little silence is not taken for noise. This errs towards keeping audio: in a recording whose
+    noise is within that range of the speech, little is removed.
+    """
+    frame_length = int(frame_seconds * sample_rate)
+    frame_count = len(audio) // frame_length
+    if frame_count == 0:
+        return np.empty((0, 2), dtype=np.int64)
+
+    frame_db = np.empty(frame_count, dtype=np.float32)
+    for block_start in range(0, frame_count, block_frames):
+        block_end = min(block_start + block_frames, frame_count)
+        frames = np.asarray(
+            audio[block_start * frame_length : block_end * frame_length]
+        ).reshape(-1, frame_length)
+        power = np.mean(np.square(frames, dtype=np.float32), axis=1)
+        frame_db[block_start:block_end] = 10 * np.log10(power + 1e-10)
+
+    # The quietest frames give the noise floor, even when there is little silence between speech
+    noise_floor_db, speech_db = np.percentile(frame_db, [2, 90])
+    threshold_db = noise_floor_db + margin_db
+    if (
+        speech_db - noise_floor_db >= margin_db
+    ):  # Some frames stand out, so there is speech
+        threshold_db = min(threshold_db, speech_db - speech_range_db)
+    threshold_db = max(floor_db, threshold_db)
+    is_speech = frame_db > threshold_db
+
+    # Rising and falling edges of the speech mask give the region boundaries
+    edges = np.diff(np.concatenate(([0], is_speech.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1) * frame_length
+    ends = np.flatnonzero(edges == -1) * frame_length
+    return np.stack([starts, ends], axis=1)
+
+
+def silero_speech_regions(audio, sample_rate=16000):
+    """
+    Speech regions from the Silero VAD model bundled with faster-whisper, as (start, end) sample pairs.
+    """
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+
+    timestamps = get_speech_timestamps(
+        np.asarray(audio), VadOptions(min_silence_duration_ms=500)
+    )
+    return np.array(
+        [[timestamp["start"], timestamp["end"]] for timestamp in timestamps],
+        dtype=np.int64,
+    ).reshape(-1, 2)
+
+
+def tidy_regions(
+    regions,
+    total_samples,
+    sample_rate=16000,
+    padding_seconds=0.2,
+    min_silence_seconds=0.5,
+    min_speech_seconds=0.25,
+):
+    """
+    Pad each region, merge regions separated by short silences and drop very short regions.
+    """
+    if len(regions) == 0:
+        return regions
+    padding = int(padding_seconds * sample_rate)
+    starts = np.clip(regions[:, 0] - padding, 0, total_samples)
+    ends = np.clip(regions[:, 1] + padding, 0, total_samples)
+
+    # A new region starts wherever the gap after the previous one is long enough
+    gaps = starts[1:] - ends[:-1]
+    new_region = np.concatenate(([True], gaps >= min_silence_seconds * sample_rate))
+    merged_starts = starts[new_region]
+    merged_ends = np.maximum.reduceat(ends, np.flatnonzero(new_region))
+
+    keep = merged_ends - merged_starts >= min_speech_seconds * sample_rate
+    return np.stack([merged_starts[keep], merged_ends[keep]], axis=1)
+
+
+def speech_regions(audio, sample_rate=16000, method="energy"):
+    """
+    Tidied (start, end) sample pairs of the speech in the audio, found with the chosen detector.
+    """
+    if method == "silero":
+        regions = silero_speech_regions(audio, sample_rate)
+    else:
+        regions = energy_speech_regions(audio, sample_rate)
+    return tidy_regions(regions, len(audio), sample_rate)
+
+
+def pause_chunks(regions, max_samples):
+    """
+    Pack consecutive speech regions into chunks of at most max_samples, breaking only at the pauses
+    between regions. A single region longer than max_samples is split into equal parts.
+    """
+    chunks = []
+    for start, end in regions:
+        if chunks and end - chunks[-1][0] <= max_samples:
+            chunks[-1][1] = end  # Extend the current chunk over the pause
+            continue
+        parts = -(-(end - start) // max_samples)  # Ceiling division
+        bounds = np.linspace(start, end, parts + 1).astype(np.int64)
+        chunks.extend(
+            [
+                [part_start, part_end]
+                for part_start, part_end in zip(bounds[:-1], bounds[1:])
+            ]
+        )
+    return np.array(chunks, dtype=np.int64).reshape(-1, 2)
+
+
+def remove_non_speech(audio, sample_rate=16000, method="energy", temporary_dir=None):
+    """
+    Return (speech-only audio, TimeMap, seconds skipped). When no speech is detected at all the
+    audio is returned unchanged, so a quiet recording is still transcribed. With temporary_dir the
+    speech-only audio is written to a memory-mapped temporary file there instead of held in memory.
+    """
+    regions = speech_regions(audio, sample_rate, method)
+    if len(regions) == 0:
+        return audio, TimeMap([0.0], [len(audio) / sample_rate]), 0.0
+
+    lengths = regions[:, 1] - regions[:, 0]
+    if temporary_dir is None:
+        speech_audio = np.empty(int(lengths.sum()), dtype=np.float32)
+    else:
+        speech_audio = np.memmap(
+            tempfile.TemporaryFile(dir=temporary_dir),
+            dtype=np.float32,
+            mode="w+",
+            shape=(int(lengths.sum()),),
+        )
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    for (start, end), offset in zip(regions, offsets):
+        speech_audio[offset : offset + end - start] = audio[start:end]
+
+    time_map = TimeMap(regions[:, 0] / sample_rate, lengths / sample_rate)
+    skipped_seconds = (len(audio) - len(speech_audio)) / sample_rate
+    return speech_audio, time_map, skipped_seconds
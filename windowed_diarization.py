@@ -0,0 +1,191 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from pyannote.core import Annotation, Segment
+from scipy.optimize import linear_sum_assignment
+
+
+def window_bounds(total_samples, window_samples, overlap_samples):
+    """
+    (start, end) sample pairs of overlapping windows covering the audio. The last window is
+    stretched to the end rather than leaving a short remainder.
+    """
+    step = window_samples - overlap_samples
+    if step <= 0:
+        raise ValueError("The overlap must be shorter than the window")
+    starts = list(range(0, max(total_samples - overlap_samples, 1), step))
+    if len(starts) > 1 and total_samples - starts[-1] < window_samples / 2:
+        starts.pop()  # Fold a short tail into the previous window
+    ends = starts[1:] + [total_samples]
+    return [
+        (start, min(next_start + overlap_samples, total_samples))
+        for start, next_start in zip(starts, ends)
+    ]
+
+
+def _diarize_window(pipeline, audio, start, end, sample_rate, uri, hints):
+    waveform = torch.from_numpy(np.ascontiguousarray(audio[start:end])).unsqueeze(0)
+    diarization, embeddings = pipeline(
+        {"uri": uri, "waveform": waveform, "sample_rate": sample_rate},
+        return_embeddings=True,
+        **hints,
+    )
+    turns = [
+        (turn.start + start / sample_rate, turn.end + start / sample_rate, label)
+        for turn, _, label in diarization.itertracks(yield_label=True)
+    ]
+    return turns, diarization.labels(), np.asarray(embeddings, dtype=np.float64)
+
+
+def _unit_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(norms > 0, matrix / norms, np.nan)
+
+
+def _overlap_seconds(turns, label, other_turns, other_label, start, end):
+    """
+    Seconds within [start, end) where label speaks in turns and other_label speaks in other_turns.
+    """
+    total = 0.0
+    for turn_start, turn_end, turn_label in turns:
+        if turn_label != label:
+            continue
+        for other_start, other_end, other_turn_label in other_turns:
+            if other_turn_label != other_label:
+                continue
+            overlap = min(turn_end, other_end, end) - max(
+                turn_start, other_start, start
+            )
+            total += max(overlap, 0.0)
+    return total
+
+
+class SpeakerStitcher:
+    """
+    Reconciles the local speaker labels of successive windows into global speakers. Local speakers
+    are matched to global ones by the cosine similarity of their embeddings with the Hungarian
+    algorithm; a speaker without a usable embedding is matched by who speaks with it in the overlap.
+    """
+
+    def __init__(self, similarity_threshold=0.5):
+        self.similarity_threshold = similarity_threshold
+        # Sum of the unit embeddings assigned to each global speaker
+        self.centroids = []
+        # (start, end, global speaker index) turns of the last window added
+        self.previous_window_turns = []
+
+    def _match_by_embedding(self, local_embeddings):
+        matches = {}
+        usable = np.flatnonzero(~np.isnan(local_embeddings).any(axis=1))
+        if len(usable) == 0 or not self.centroids:
+            return matches
+        similarity = local_embeddings[usable] @ _unit_rows(np.array(self.centroids)).T
+        similarity = np.nan_to_num(similarity, nan=-1.0)  # Speakers without embeddings
+        rows, columns = linear_sum_assignment(-similarity)
+        for row, column in zip(rows, columns):
+            if similarity[row, column] >= self.similarity_threshold:
+                matches[usable[row]] = column
+        return matches
+
+    def add_window(self, turns, labels, embeddings, overlap_start, overlap_end):
+        local_embeddings = _unit_rows(embeddings.reshape(len(labels), -1))
+        matches = self._match_by_embedding(local_embeddings)
+
+        taken = set(matches.values())
+        for local_index, label in enumerate(labels):
+            if local_index in matches:
+                continue
+            # No confident embedding match: fall back to agreement in the overlap with the last window
+            shared = {
+                speaker: _overlap_seconds(
+                    turns,
+                    label,
+                    self.previous_window_turns,
+                    speaker,
+                    overlap_start,
+                    overlap_end,
+                )
+                for speaker in range(len(self.centroids))
+                if speaker not in taken
+            }
+            best = max(shared, key=shared.get, default=None)
+            if best is not None and shared[best] > 0:
+                matches[local_index] = best
+            else:
+                matches[local_index] = len(self.centroids)
+                self.centroids.append(np.zeros(local_embeddings.shape[1]))
+            taken.add(matches[local_index])
+
+        for local_index, speaker in matches.items():
+            if not np.isnan(local_embeddings[local_index]).any():
+                self.centroids[speaker] = (
+                    self.centroids[speaker] + local_embeddings[local_index]
+                )
+        label_speakers = {labels[index]: speaker for index, speaker in matches.items()}
+        self.previous_window_turns = [
+            (start, end, label_speakers[label]) for start, end, label in turns
+        ]
+        return self.previous_window_turns
+
+
+def diarize_windowed(
+    pipeline,
+    audio,
+    sample_rate=16000,
+    window_seconds=1800,
+    overlap_seconds=60,
+    uri="audio",
+    workers=1,
+    similarity_threshold=0.5,
+    **hints,
+):
+    """
+    Diarize the audio in overlapping windows and return one pyannote Annotation on the audio's clock
+    with speakers consistent across windows. Each window only keeps the turns in its own half of
+    each overlap, so no stretch of audio is counted twice. With workers > 1 the windows are
+    diarized in a thread pool sharing the one pipeline.
+    """
+    bounds = window_bounds(
+        len(audio),
+        int(window_seconds * sample_rate),
+        int(overlap_seconds * sample_rate),
+    )
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            lambda window: _diarize_window(
+                pipeline, audio, *window, sample_rate, uri, hints
+            ),
+            bounds,
+        )
+
+        stitcher = SpeakerStitcher(similarity_threshold)
+        kept_turns = []
+        previous_end = 0
+        for (start, end), (turns, labels, embeddings) in zip(bounds, results):
+            window_start, window_end = start / sample_rate, end / sample_rate
+            global_turns = stitcher.add_window(
+                turns, labels, embeddings, window_start, previous_end / sample_rate
+            )
+
+            # Keep the turns between the midpoints of this window's overlaps with its neighbours
+            keep_from = (
+                (window_start + previous_end / sample_rate) / 2 if start else 0.0
+            )
+            next_start = end - int(overlap_seconds * sample_rate)
+            keep_to = (
+                (next_start / sample_rate + window_end) / 2
+                if end < len(audio)
+                else window_end
+            )
+            for turn_start, turn_end, speaker in global_turns:
+                clipped_start = max(turn_start, keep_from)
+                clipped_end = min(turn_end, keep_to)
+                if clipped_end > clipped_start:
+                    kept_turns.append((clipped_start, clipped_end, speaker))
+            previous_end = end
+
+    annotation = Annotation(uri=uri)
+    for track, (turn_start, turn_end, speaker) in enumerate(sorted(kept_turns)):
+        annotation[Segment(turn_start, turn_end), track] = f"SPEAKER_{speaker:02d}"
+    return annotation